@@ -12,6 +12,7 @@ import titiler_sentinel as titiler_sentinel
 
 # Export the DNS name of the bucket
 pulumi.export("titiler_sentinel_url", titiler_sentinel.lambda_api.api_endpoint)
+pulumi.export("titiler_tile_cache_bucket", titiler_sentinel.tile_cache_bucket.id)
 pulumi.export(
     "cloud_run_offset_tile_url", cloud_run_offset_tile.default.statuses[0].url
 )
@@ -26,5 +27,9 @@ pulumi.export(
     "scene_relevancy_url", cloud_function_scene_relevancy.fxn.https_trigger_url
 )
 pulumi.export("historical_run_url", cloud_function_historical_run.fxn.https_trigger_url)
+pulumi.export(
+    "historical_run_checkpoint_bucket",
+    cloud_function_historical_run.checkpoint_bucket.url,
+)
 pulumi.export("sns_topic_subscription", sns_subscription.sentinel1_sqs_target.arn)
 pulumi.export("api_key", pulumi.Config("project-cloud").require("apikey"))
@@ -0,0 +1,249 @@
+"""benchmark the offset tile inference container at several CPU and concurrency
+settings, and save the best one to the stack config read by cloud_run_offset_tile
+
+The recorded requests are a JSON lines file, one request per line:
+
+    {"method": "POST", "path": "/predict", "body": {...}, "headers": {...}}
+
+Each setting replays the whole batch against a local container started with
+that CPU limit, with as many requests in flight as the container concurrency,
+and reports throughput, p50/p95/p99 latency and peak memory.
+
+Example:
+    python benchmark_offset_tile.py --image gcr.io/project/offset-tile:latest \
+        --requests recorded_requests.jsonl --cpus 2,4,8 --concurrency 1,2,3,4,6 \
+        --env SOURCE=local --max-p95 20 --stack staging
+"""
+import argparse
+import json
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import docker
+from benchmark_stats import percentile
+
+
+def send(url: str, request: Dict) -> float:
+    """Send one recorded request and return its latency in seconds"""
+    body = request.get("body")
+    data = json.dumps(body).encode() if body is not None else None
+    headers = {"Content-Type": "application/json", **request.get("headers", {})}
+    req = urllib.request.Request(
+        url + request.get("path", "/"),
+        data=data,
+        headers=headers,
+        method=request.get("method", "POST"),
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=600) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def wait_until_ready(url: str, timeout: float = 300):
+    """Wait for the container to answer HTTP requests"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            return
+        except urllib.error.HTTPError:
+            # any HTTP answer means the server is up
+            return
+        # socket.timeout is not a TimeoutError before Python 3.10
+        except (urllib.error.URLError, ConnectionError, TimeoutError, socket.timeout):
+            time.sleep(1)
+    raise TimeoutError(f"{url} did not start within {timeout}s")
+
+
+class MemoryMonitor(threading.Thread):
+    """Poll the memory usage of a container and keep the peak
+
+    Only the current usage is sampled: the container's max_usage covers its
+    whole life, including the settings benchmarked before on it.
+    """
+
+    def __init__(self, container, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.container = container
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            stats = self.container.stats(stream=False).get("memory_stats", {})
+            self.peak = max(self.peak, stats.get("usage", 0))
+            time.sleep(self.interval)
+
+    def stop(self) -> int:
+        self.running = False
+        self.join()
+        return self.peak
+
+
+def replay(url: str, requests: List[Dict], concurrency: int) -> Dict:
+    """Replay all requests with `concurrency` requests in flight"""
+
+    def timed(request) -> Optional[float]:
+        # the latency of the request, or None if it failed
+        try:
+            return send(url, request)
+        # socket.timeout is not a TimeoutError before Python 3.10
+        except (urllib.error.URLError, ConnectionError, TimeoutError, socket.timeout):
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(timed, requests))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency in outcomes if latency is not None]
+    errors = len(outcomes) - len(latencies)
+    return dict(
+        throughput=len(latencies) / elapsed,
+        p50=percentile(latencies, 50) if latencies else float("inf"),
+        p95=percentile(latencies, 95) if latencies else float("inf"),
+        p99=percentile(latencies, 99) if latencies else float("inf"),
+        errors=errors,
+    )
+
+
+def benchmark(
+    image: str,
+    requests: List[Dict],
+    cpus: List[float],
+    concurrencies: List[int],
+    memory: str,
+    env: Dict[str, str],
+    port: int,
+    warmup: int,
+) -> List[Dict]:
+    """Benchmark every CPU and concurrency combination
+
+    Returns:
+        List[Dict]: one result per setting
+    """
+    client = docker.from_env()
+    results = []
+    for cpu in cpus:
+        print(f"Starting {image} with {cpu} CPUs ...")
+        container = client.containers.run(
+            image,
+            detach=True,
+            remove=True,
+            environment={"PORT": str(port), **env},
+            ports={f"{port}/tcp": None},
+            nano_cpus=int(cpu * 1e9),
+            mem_limit=memory.replace("Gi", "g").replace("Mi", "m"),
+        )
+        try:
+            container.reload()
+            host_port = container.ports[f"{port}/tcp"][0]["HostPort"]
+            url = f"http://127.0.0.1:{host_port}"
+            wait_until_ready(url)
+            # warm up model loading and caches outside of the measurements
+            replay(url, requests[:warmup], 1)
+            for concurrency in concurrencies:
+                monitor = MemoryMonitor(container)
+                monitor.start()
+                result = replay(url, requests, concurrency)
+                result.update(
+                    cpu=cpu,
+                    container_concurrency=concurrency,
+                    peak_memory_mib=monitor.stop() / 1024**2,
+                )
+                print(
+                    "cpu={cpu:g} concurrency={container_concurrency} "
+                    "throughput={throughput:.2f}/s p50={p50:.2f}s p95={p95:.2f}s "
+                    "p99={p99:.2f}s peak_memory={peak_memory_mib:.0f}MiB "
+                    "errors={errors}".format(**result)
+                )
+                results.append(result)
+        finally:
+            container.stop()
+    return results
+
+
+def best_setting(results: List[Dict], max_p95: Optional[float]) -> Optional[Dict]:
+    """The highest throughput setting without errors and within the p95 budget,
+    preferring fewer CPUs on ties"""
+    candidates = [
+        result
+        for result in results
+        if not result["errors"] and (max_p95 is None or result["p95"] <= max_p95)
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda r: (round(r["throughput"], 2), -r["cpu"]))
+
+
+def save_setting(stack: str, setting: Dict, memory: str):
+    """Write a setting to the offset_tile object of the stack config"""
+    values = {
+        "offset_tile.cpu": f"{int(setting['cpu'] * 1000)}m",
+        "offset_tile.memory": memory,
+        "offset_tile.container_concurrency": str(setting["container_concurrency"]),
+    }
+    for key, value in values.items():
+        subprocess.run(
+            ["pulumi", "config", "set", "--stack", stack, "--path", key, value],
+            check=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", required=True, help="offset tile image")
+    parser.add_argument("--requests", required=True, help="recorded requests")
+    parser.add_argument("--cpus", default="2,4,8", help="CPU limits to try")
+    parser.add_argument(
+        "--concurrency", default="1,2,3,4,6", help="container concurrencies to try"
+    )
+    parser.add_argument("--memory", default="4Gi", help="memory limit")
+    parser.add_argument(
+        "--env", action="append", default=[], help="container env, as KEY=VALUE"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--warmup", type=int, default=3, help="warm up requests")
+    parser.add_argument("--max-p95", type=float, help="p95 latency budget, seconds")
+    parser.add_argument("--stack", help="save the best setting to this stack")
+    parser.add_argument("--output", help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.requests) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    results = benchmark(
+        args.image,
+        requests,
+        [float(cpu) for cpu in args.cpus.split(",")],
+        [int(concurrency) for concurrency in args.concurrency.split(",")],
+        args.memory,
+        dict(env.split("=", 1) for env in args.env),
+        args.port,
+        args.warmup,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    best = best_setting(results, args.max_p95)
+    if best is None:
+        print("No setting met the latency budget without errors.")
+        return
+    print(
+        "Best: cpu={cpu:g} concurrency={container_concurrency} "
+        "throughput={throughput:.2f}/s p95={p95:.2f}s".format(**best)
+    )
+    if args.stack:
+        save_setting(args.stack, best, args.memory)
+        print(f"Saved to the offset_tile config of stack {args.stack}.")
+
+
+if __name__ == "__main__":
+    main()
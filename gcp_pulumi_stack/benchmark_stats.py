@@ -0,0 +1,11 @@
+"""statistics shared by the benchmark scripts, without their dependencies"""
+import math
+from typing import List
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of values: the smallest value with at
+    least q% of the values at or below it"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
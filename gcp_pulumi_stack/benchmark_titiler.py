@@ -0,0 +1,151 @@
+"""benchmark the titiler performance profiles by rendering a fixed tile set from
+local COGs under each profile
+
+Every profile runs in its own process, with the profile's GDAL/rio-tiler
+environment and as many CPUs as Lambda gives its memory size, so settings read
+once at import or GDAL initialisation apply. Each tile is rendered the way the
+lambda renders a request: open the COG, read the tile, encode a PNG. The report
+gives the time per tile and the bytes read from disk per tile (Linux only).
+
+Local files do not exercise the HTTP settings (VSI_CACHE_SIZE,
+GDAL_INGESTED_BYTES_AT_OPEN), but the same script accepts COG URLs.
+
+Example:
+    python benchmark_titiler.py --cogs "scenes/*.tif" --zoom 12 --tiles 50
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmark_stats import percentile
+from titiler_profiles import PROFILES
+
+# Lambda allocates one vCPU per 1769 MB of memory
+LAMBDA_MB_PER_VCPU = 1769
+
+
+def bytes_read() -> int:
+    """Bytes this process read through system calls so far"""
+    with open("/proc/self/io") as f:
+        stats = dict(line.split(": ") for line in f.read().splitlines())
+    return int(stats["rchar"])
+
+
+def tile_set(cogs: List[str], zoom: int, tiles: int) -> List[Dict]:
+    """The first `tiles` tiles at `zoom` covering each COG, in a stable order"""
+    from rio_tiler.io import Reader
+
+    selected = []
+    for path in cogs:
+        with Reader(path) as cog:
+            bounds = cog.get_geographic_bounds(cog.tms.rasterio_geographic_crs)
+            for tile in sorted(cog.tms.tiles(*bounds, zooms=[zoom]))[:tiles]:
+                selected.append(dict(path=path, x=tile.x, y=tile.y, z=tile.z))
+    return selected
+
+
+def render(tiles: List[Dict]) -> Dict:
+    """Render the tiles and measure the time and bytes read per tile"""
+    from rio_tiler.errors import TileOutsideBounds
+    from rio_tiler.io import Reader
+
+    durations = []
+    start_bytes = bytes_read()
+    for tile in tiles:
+        start = time.perf_counter()
+        try:
+            with Reader(tile["path"]) as cog:
+                cog.tile(tile["x"], tile["y"], tile["z"]).render(img_format="PNG")
+        except TileOutsideBounds:
+            continue
+        durations.append(time.perf_counter() - start)
+    if not durations:
+        # no tile of the set is within the COGs
+        nan = float("nan")
+        return dict(tiles=0, mean_ms=nan, p50_ms=nan, p95_ms=nan, bytes_per_tile=nan)
+    return dict(
+        tiles=len(durations),
+        mean_ms=1000 * sum(durations) / len(durations),
+        p50_ms=1000 * percentile(durations, 50),
+        p95_ms=1000 * percentile(durations, 95),
+        bytes_per_tile=(bytes_read() - start_bytes) / len(durations),
+    )
+
+
+def run_profile(name: str, tiles_file: str) -> Dict:
+    """Render the tile set in a child process configured with a profile"""
+    profile = PROFILES[name]
+    env = {**os.environ, **profile["env"]}
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", name, "--tiles-file", tiles_file],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def worker(name: str, tiles_file: str):
+    """Child process entrypoint: limit CPUs like Lambda, then render"""
+    vcpus = math.ceil(PROFILES[name]["memory_size"] / LAMBDA_MB_PER_VCPU)
+    if hasattr(os, "sched_setaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, available[:vcpus])
+    with open(tiles_file) as f:
+        tiles = json.load(f)
+    print(json.dumps(render(tiles)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cogs", help="glob of local COGs, or comma separated URLs")
+    parser.add_argument("--zoom", type=int, default=12, help="zoom of the tile set")
+    parser.add_argument("--tiles", type=int, default=50, help="tiles per COG")
+    parser.add_argument(
+        "--profiles", default=",".join(PROFILES), help="profiles to compare"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per profile")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--tiles-file", default="titiler_benchmark_tiles.json")
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.tiles_file)
+        return
+
+    if "://" in args.cogs:
+        cogs = args.cogs.split(",")
+    else:
+        cogs = sorted(glob.glob(args.cogs))
+    with open(args.tiles_file, "w") as f:
+        json.dump(tile_set(cogs, args.zoom, args.tiles), f)
+
+    print(
+        f"{'profile':<14} {'tiles':>6} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'KiB/tile':>9}"
+    )
+    for name in args.profiles.split(","):
+        # keep the fastest run, the others include first-read noise
+        result = min(
+            (run_profile(name, args.tiles_file) for _ in range(args.repeat)),
+            key=lambda r: r["mean_ms"],
+        )
+        if not result["tiles"]:
+            print(f"{name:<14} no tile rendered, check --zoom and --cogs")
+            continue
+        print(
+            f"{name:<14} {result['tiles']:>6} {result['mean_ms']:>8.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+            f"{result['bytes_per_tile'] / 1024:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
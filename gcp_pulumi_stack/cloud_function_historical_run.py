@@ -1,48 +1,76 @@
 """cloud function to select appropriate scenes (over water and IW) from SNS notification"""
 import os
-import time
 
 import cloud_function_scene_relevancy
 import cloud_run_orchestrator
 import database
 import pulumi
+from historical_run_checkpoints import checkpoint_bucket
 from pulumi_gcp import cloudfunctions, storage
-from utils import construct_name
+from utils import construct_name, create_source_archive
 
 stack = pulumi.get_stack()
+config = pulumi.Config("project-cloud")
+
+# the function records the chunks it dispatches, see historical_run_checkpoints.py
+checkpoint_bucket_iam = storage.BucketIAMMember(
+    construct_name("bucket-historical-run-checkpoints-iam"),
+    bucket=checkpoint_bucket.name,
+    role="roles/storage.objectAdmin",
+    member=cloud_function_scene_relevancy.cloud_function_service_account.email.apply(
+        lambda email: f"serviceAccount:{email}"
+    ),
+)
 
 function_name = construct_name("cloud-function-historical-run")
 config_values = {
     "DB_URL": database.sql_instance_url,
     "GCP_PROJECT": pulumi.Config("gcp").require("project"),
     "GCP_LOCATION": pulumi.Config("gcp").require("region"),
-    "QUEUE": cloud_function_scene_relevancy.queue.name,
+    "QUEUE": cloud_function_scene_relevancy.backfill_queue.name,
     "ORCHESTRATOR_URL": cloud_run_orchestrator.default.statuses[0].url,
     "FUNCTION_NAME": function_name,
     "SCIHUB_USERNAME": pulumi.Config("scihub").require("username"),
     "SCIHUB_PASSWORD": pulumi.Config("scihub").require("password"),
     "API_KEY": pulumi.Config("project-cloud").require("apikey"),
     "IS_DRY_RUN": pulumi.Config("project-cloud").require("dryrun_historical"),
+    # Read by scene_batches.settings_from_env: scenes are dispatched to the
+    # orchestrator in chunks of at most BATCH_SCENES scenes or BATCH_TILES
+    # estimated tiles, one task per chunk. A BATCH_SCENES of 1 keeps one task
+    # per scene, the only payload the orchestrator accepts so far. A chunk is
+    # capped at the scenes that fit in DISPATCH_DEADLINE at SCENE_SECONDS each,
+    # by default the time the orchestrator allows one scene.
+    "BATCH_SCENES": str(config.get_int("batch_scenes") or 1),
+    "BATCH_TILES": str(config.get_int("batch_tiles") or 0),
+    # Cloud Tasks caps HTTP task deadlines at 30 minutes
+    "DISPATCH_DEADLINE": config.get("batch_dispatch_deadline") or "1800s",
+    "SCENE_SECONDS": str(
+        config.get_int("batch_scene_seconds")
+        or cloud_run_orchestrator.scene_timeout_seconds
+    ),
+    # a chunk not done this long after it was dispatched is dispatched again:
+    # the backfill queue retries for up to an hour, plus one dispatch deadline
+    "RETRY_WINDOW": str(config.get_int("batch_retry_window") or 5400),
+    "CHECKPOINT_BUCKET": checkpoint_bucket.name,
 }
 
 # The Cloud Function source code itself needs to be zipped up into an
-# archive, which we create using the pulumi.AssetArchive primitive.
+# archive. The archive is reproducible and named by its content hash, so the
+# object (and the function) is only replaced when the source code changes.
+# scene_batches is added next to the handler, which imports it.
 PATH_TO_SOURCE_CODE = "../project_cloud/cloud_function_historical_run"
-assets = {}
-for file in os.listdir(PATH_TO_SOURCE_CODE):
-    location = os.path.join(PATH_TO_SOURCE_CODE, file)
-    asset = pulumi.FileAsset(path=location)
-    assets[file] = asset
-
-archive = pulumi.AssetArchive(assets=assets)
+source_archive_path, source_archive_name = create_source_archive(
+    PATH_TO_SOURCE_CODE,
+    extra_files=[os.path.join(os.path.dirname(__file__), "scene_batches.py")],
+)
 
 # Create the single Cloud Storage object, which contains all of the function's
 # source code. ("main.py" and "requirements.txt".)
 source_archive_object = storage.BucketObject(
     construct_name("source-cloud-function-historical-run"),
-    name="handler.py-%f" % time.time(),
+    name=source_archive_name,
     bucket=cloud_function_scene_relevancy.bucket.name,
-    source=archive,
+    source=pulumi.FileAsset(source_archive_path),
 )
 
 fxn = cloudfunctions.Function(
@@ -1,12 +1,15 @@
 """cloud function to select appropriate scenes (over water and IW) from SNS notification"""
-import os
-import time
-
 import cloud_run_orchestrator
 import database
 import pulumi
 from pulumi_gcp import cloudfunctions, cloudtasks, projects, serviceaccount, storage
-from utils import construct_name
+from utils import (
+    DISPATCH_DEFAULTS,
+    construct_name,
+    create_source_archive,
+    dispatch_overrides,
+    dispatch_profile,
+)
 
 stack = pulumi.get_stack()
 # We will store the source code to the Cloud Function in a Google Cloud Storage bucket.
@@ -16,24 +19,53 @@ bucket = storage.Bucket(
     labels={"pulumi": "true", "environment": pulumi.get_stack()},
 )
 
-# Create the Queue for tasks
-queue = cloudtasks.Queue(
-    construct_name("queue-cloud-run-orchestrator"),
-    location=pulumi.Config("gcp").require("region"),
-    rate_limits=cloudtasks.QueueRateLimitsArgs(
-        max_concurrent_dispatches=1,
-        max_dispatches_per_second=1,
-    ),
-    retry_config=cloudtasks.QueueRetryConfigArgs(
-        max_attempts=3,
-        max_backoff="300s",
-        max_doublings=1,
-        max_retry_duration="4s",
-        min_backoff="60s",
-    ),
-    stackdriver_logging_config=cloudtasks.QueueStackdriverLoggingConfigArgs(
-        sampling_ratio=0.9,
-    ),
+# Create the Queues for tasks: live scenes from the SNS notifications, and
+# backfills from historical runs, so a large backfill never delays live scenes.
+# Both are sized from the orchestrator resources and the database connection
+# budget; every setting can be overridden per stack in the "queue" namespace.
+dispatch_config = pulumi.Config("queue")
+dispatch_settings = dispatch_overrides(
+    {key: dispatch_config.get(key) for key in DISPATCH_DEFAULTS}
+)
+
+# the orchestrator's own instance limit, when the stack sets one
+orchestrator_limits = {
+    key: int(cloud_run_orchestrator.settings[key])
+    for key in ("max_instances",)
+    if key in cloud_run_orchestrator.settings
+}
+
+
+def orchestrator_queue(resource_name: str, traffic: str, **defaults):
+    """Create a queue dispatching scenes to the orchestrator"""
+    profile = dispatch_profile(
+        cloud_run_orchestrator.resources["cpu"],
+        cloud_run_orchestrator.resources["memory"],
+        database.max_connections,
+        {
+            **defaults,
+            **orchestrator_limits,
+            **dispatch_settings,
+            **dispatch_overrides(dispatch_config.get_object(traffic) or {}),
+        },
+    )
+    return cloudtasks.Queue(
+        construct_name(resource_name),
+        location=pulumi.Config("gcp").require("region"),
+        rate_limits=cloudtasks.QueueRateLimitsArgs(**profile["rate_limits"]),
+        retry_config=cloudtasks.QueueRetryConfigArgs(**profile["retry_config"]),
+        stackdriver_logging_config=cloudtasks.QueueStackdriverLoggingConfigArgs(
+            sampling_ratio=0.9,
+        ),
+    )
+
+
+queue = orchestrator_queue("queue-cloud-run-orchestrator", "live", share=0.25)
+backfill_queue = orchestrator_queue(
+    "queue-cloud-run-orchestrator-backfill",
+    "backfill",
+    share=0.75,
+    max_retry_duration="3600s",
 )
 
 function_name = construct_name("cloud-function-scene-relevancy")
@@ -49,23 +81,18 @@ config_values = {
 }
 
 # The Cloud Function source code itself needs to be zipped up into an
-# archive, which we create using the pulumi.AssetArchive primitive.
+# archive. The archive is reproducible and named by its content hash, so the
+# object (and the function) is only replaced when the source code changes.
 PATH_TO_SOURCE_CODE = "../project_cloud/cloud_function_scene_relevancy"
-assets = {}
-for file in os.listdir(PATH_TO_SOURCE_CODE):
-    location = os.path.join(PATH_TO_SOURCE_CODE, file)
-    asset = pulumi.FileAsset(path=location)
-    assets[file] = asset
-
-archive = pulumi.AssetArchive(assets=assets)
+source_archive_path, source_archive_name = create_source_archive(PATH_TO_SOURCE_CODE)
 
 # Create the single Cloud Storage object, which contains all of the function's
 # source code. ("main.py" and "requirements.txt".)
 source_archive_object = storage.BucketObject(
     construct_name("source-cloud-function-scene-relevancy"),
-    name="handler.py-%f" % time.time(),
+    name=source_archive_name,
     bucket=bucket.name,
-    source=archive,
+    source=pulumi.FileAsset(source_archive_path),
 )
 
 # Assign access to cloud SQL
@@ -4,7 +4,13 @@ Reference doc: https://www.pulumi.com/blog/build-publish-containers-iac/
 import cloud_run_images
 import pulumi
 import pulumi_gcp as gcp
-from utils import construct_name
+from utils import construct_name, scaling_annotations, service_config
+
+# resources and concurrency can be tuned per stack with benchmark_offset_tile.py
+settings = service_config("offset_tile")
+cpu = settings.get("cpu", "8000m")
+memory = settings.get("memory", "4Gi")
+container_concurrency = int(settings.get("container_concurrency", 3))
 
 service_name = construct_name("cloud-run-offset-tiles")
 default = gcp.cloudrun.Service(
@@ -26,13 +32,14 @@ default = gcp.cloudrun.Service(
                             value=pulumi.Config("project-cloud").require("apikey"),
                         ),
                     ],
-                    resources=dict(limits=dict(memory="4Gi", cpu="8000m")),
+                    resources=dict(limits=dict(memory=memory, cpu=cpu)),
                 ),
             ],
-            container_concurrency=3,
+            container_concurrency=container_concurrency,
         ),
         metadata=dict(
             name=service_name + "-" + cloud_run_images.cloud_run_offset_tile_sha,
+            annotations=scaling_annotations(settings) or None,
         ),
     ),
     metadata=gcp.cloudrun.ServiceMetadataArgs(
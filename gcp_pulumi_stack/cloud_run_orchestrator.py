@@ -5,13 +5,15 @@ import os
 
 import cloud_run_images
 import cloud_run_offset_tile
+import database
 import git
 import pulumi
 import pulumi_gcp as gcp
 import titiler_sentinel
 from cloud_run_offset_tile import noauth_iam_policy_data
 from database import instance, sql_instance_url_with_asyncpg
-from utils import construct_name
+from historical_run_checkpoints import checkpoint_bucket
+from utils import construct_name, scaling_annotations, service_config
 
 config = pulumi.Config()
 
@@ -21,7 +23,38 @@ git_tag = next((tag.name for tag in repo.tags if tag.commit == repo.head.commit)
 
 data_raster = config.require("data")
 
+resources = dict(memory="4Gi", cpu="4000m")
+settings = {"db_connections": 100, **service_config("orchestrator")}
+# the request timeout, the longest the orchestrator may take for one scene
+scene_timeout_seconds = 3540
+
 service_name = construct_name("cloud-run-orchestrator")
+template_annotations = {
+    "run.googleapis.com/cloudsql-instances": instance.connection_name,
+}
+template_annotations.update(scaling_annotations(settings))
+# values set with `pulumi config set --path` are strings
+container_concurrency = (
+    int(settings["container_concurrency"])
+    if "container_concurrency" in settings
+    else None
+)
+sidecars = []
+db_url = sql_instance_url_with_asyncpg
+db_pool_mode = "direct"
+if database.pooler_enabled:
+    # Prepared statements do not survive PgBouncer transaction pooling. The url
+    # turns off SQLAlchemy's statement cache; asyncpg's own cache and statement
+    # names are connect arguments that cannot be set in a url, so with
+    # DB_POOL_MODE=transaction the engine connects with
+    # connect_args=dict(statement_cache_size=0,
+    #                   prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__")
+    db_pool_mode = "transaction"
+    db_url = database.pooled_url(
+        "postgresql+asyncpg", "prepared_statement_cache_size=0"
+    )
+    sidecars.append(database.pooler_sidecar(settings, pool_mode="transaction"))
+    template_annotations.update(database.pooler_annotations("orchestrator"))
 default = gcp.cloudrun.Service(
     service_name,
     name=service_name,
@@ -30,11 +63,16 @@ default = gcp.cloudrun.Service(
         spec=gcp.cloudrun.ServiceTemplateSpecArgs(
             containers=[
                 gcp.cloudrun.ServiceTemplateSpecContainerArgs(
+                    name="orchestrator" if sidecars else None,
                     image=cloud_run_images.cloud_run_orchestrator_image.name,
                     envs=[
                         gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
                             name="DB_URL",
-                            value=sql_instance_url_with_asyncpg,
+                            value=db_url,
+                        ),
+                        gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
+                            name="DB_POOL_MODE",
+                            value=db_pool_mode,
                         ),
                         gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
                             name="TITILER_URL",
@@ -76,17 +114,24 @@ default = gcp.cloudrun.Service(
                             name="API_KEY",
                             value=pulumi.Config("project-cloud").require("apikey"),
                         ),
+                        # completed historical-run chunks are recorded here
+                        gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
+                            name="CHECKPOINT_BUCKET",
+                            value=checkpoint_bucket.name,
+                        ),
                     ],
-                    resources=dict(limits=dict(memory="4Gi", cpu="4000m")),
+                    resources=dict(limits=resources),
+                    # with sidecars, the ingress container must declare its port
+                    ports=[dict(container_port=8080)] if sidecars else None,
                 ),
+                *sidecars,
             ],
-            timeout_seconds=3540,
+            container_concurrency=container_concurrency,
+            timeout_seconds=scene_timeout_seconds,
         ),
         metadata=dict(
             name=service_name + "-" + cloud_run_images.cloud_run_orchestrator_sha,
-            annotations={
-                "run.googleapis.com/cloudsql-instances": instance.connection_name,
-            },
+            annotations=template_annotations,
         ),
     ),
     metadata=gcp.cloudrun.ServiceMetadataArgs(
@@ -2,15 +2,41 @@
 Reference doc: https://www.pulumi.com/blog/build-publish-containers-iac/
 """
 import cloud_run_images
+import database
 import pulumi
 import pulumi_gcp as gcp
 from cloud_run_offset_tile import noauth_iam_policy_data
 from database import instance, sql_instance_url
-from utils import construct_name
+from utils import construct_name, scaling_annotations, service_config
 
 config = pulumi.Config()
+settings = {"db_connections": 50, **service_config("tifeatures")}
 
 service_name = construct_name("cloud-run-tifeatures")
+template_annotations = {
+    "run.googleapis.com/cloudsql-instances": instance.connection_name,
+}
+template_annotations.update(scaling_annotations(settings))
+# values set with `pulumi config set --path` are strings
+container_concurrency = (
+    int(settings["container_concurrency"])
+    if "container_concurrency" in settings
+    else None
+)
+# the size of tifeatures' own asyncpg pool
+db_pool_size = int(settings.get("db_pool_size", 10))
+sidecars = []
+db_url = sql_instance_url
+if database.pooler_enabled:
+    # session pooling, as tifeatures' own asyncpg pool uses prepared statements;
+    # each of its connections holds a server connection of the pooler
+    db_url = database.pooled_url("postgresql")
+    sidecars.append(
+        database.pooler_sidecar(
+            settings, pool_mode="session", client_pool_size=db_pool_size
+        )
+    )
+    template_annotations.update(database.pooler_annotations("tifeatures"))
 default = gcp.cloudrun.Service(
     service_name,
     name=service_name,
@@ -19,26 +45,32 @@ default = gcp.cloudrun.Service(
         spec=gcp.cloudrun.ServiceTemplateSpecArgs(
             containers=[
                 gcp.cloudrun.ServiceTemplateSpecContainerArgs(
+                    name="tifeatures" if sidecars else None,
                     image=cloud_run_images.cloud_run_tifeatures_image.name,
                     envs=[
                         gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
                             name="DATABASE_URL",
-                            value=sql_instance_url,
+                            value=db_url,
                         ),
                         gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
                             name="TIFEATURES_NAME", value="project OGC API"
                         ),
+                        gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(
+                            name="DB_MAX_CONN_SIZE", value=str(db_pool_size)
+                        ),
                     ],
                     resources=dict(limits=dict(memory="2Gi", cpu="4000m")),
+                    # with sidecars, the ingress container must declare its port
+                    ports=[dict(container_port=8080)] if sidecars else None,
                 ),
+                *sidecars,
             ],
+            container_concurrency=container_concurrency,
             timeout_seconds=420,
         ),
         metadata=dict(
             name=service_name + "-" + cloud_run_images.cloud_run_tifeatures_sha,
-            annotations={
-                "run.googleapis.com/cloudsql-instances": instance.connection_name,
-            },
+            annotations=template_annotations,
         ),
     ),
     metadata=gcp.cloudrun.ServiceMetadataArgs(
@@ -0,0 +1,26 @@
+"""parse the Cloud Run limits and flags of the stack config
+
+This module does not depend on pulumi, so scripts run outside of a pulumi
+program, like scaling_report.py, can use it too.
+"""
+
+
+def parse_cpu(cpu: str) -> float:
+    """Convert a Cloud Run CPU limit ("4000m" or "4") to a number of vCPUs"""
+    if cpu.endswith("m"):
+        return int(cpu[:-1]) / 1000
+    return float(cpu)
+
+
+def parse_memory(memory: str) -> float:
+    """Convert a Cloud Run memory limit ("512Mi" or "4Gi") to GiB"""
+    units = {"Mi": 1 / 1024, "Gi": 1, "M": 1e6 / 1024**3, "G": 1e9 / 1024**3}
+    for unit, factor in units.items():
+        if memory.endswith(unit):
+            return float(memory[: -len(unit)]) * factor
+    return float(memory) / 1024**3
+
+
+def flag(value) -> bool:
+    """Read a boolean setting, which `pulumi config set --path` stores as text"""
+    return str(value).lower() == "true"
@@ -1,9 +1,23 @@
 """database configurations
 """
+import json
+
 import pulumi
 import pulumi_gcp as gcp
 from utils import construct_name
 
+# Connection budget shared by every service connecting to the instance
+max_connections = 200
+
+# Optional PgBouncer sidecar in front of the Cloud SQL socket of each Cloud Run
+# instance, so autoscaling services cannot exhaust max_connections.
+pooler_enabled = pulumi.Config("db").get_bool("pooler") or False
+pooler_image = pulumi.Config("db").get("pooler-image") or "edoburu/pgbouncer:1.20.1"
+pooler_port = 6432
+# Cloud Run defaults for services that do not set their limits
+DEFAULT_MAX_INSTANCES = 100
+DEFAULT_CONTAINER_CONCURRENCY = 80
+
 # See versions at https://registry.terraform.io/providers/hashicorp/google/latest/docs/resources/sql_database_instance#database_version
 instance = gcp.sql.DatabaseInstance(
     construct_name("database-instance"),
@@ -12,7 +26,7 @@ instance = gcp.sql.DatabaseInstance(
     settings=gcp.sql.DatabaseInstanceSettingsArgs(
         tier=pulumi.Config("db").require("db-instance"),
         backup_configuration=dict(enabled=True),
-        database_flags=[dict(name="max_connections", value=200)],
+        database_flags=[dict(name="max_connections", value=max_connections)],
     ),
     deletion_protection=True,
 )
@@ -55,3 +69,95 @@ sql_instance_url_alembic = pulumi.Output.concat(
     "/",
     db_name,
 )
+
+
+def pooled_url(driver: str, query: str = "") -> pulumi.Output:
+    """Database url of the PgBouncer sidecar, reachable on localhost
+
+    Args:
+        driver (str): the url scheme, e.g. "postgresql+asyncpg"
+        query (str): extra url query parameters
+
+    Returns:
+        pulumi.Output: the url
+    """
+    return pulumi.Output.concat(
+        driver,
+        "://",
+        db_name,
+        ":",
+        pulumi.Config("db").require_secret("db-password"),
+        "@127.0.0.1:",
+        str(pooler_port),
+        "/",
+        db_name,
+        "?" if query else "",
+        query,
+    )
+
+
+def pooler_sidecar(
+    settings: dict, pool_mode: str, client_pool_size: int = 1
+) -> gcp.cloudrun.ServiceTemplateSpecContainerArgs:
+    """PgBouncer sidecar container sized for one instance of a Cloud Run service
+
+    The service's `db_connections` budget is split evenly between its
+    `max_instances`, and no instance keeps more server connections than its
+    `container_concurrency` requests can use at once. In session mode every
+    client connection holds a server connection, so an instance keeps at least
+    as many as the application's own connection pool opens, even over the
+    budget.
+
+    Args:
+        settings (dict): the service settings from `utils.service_config`
+        pool_mode (str): the PgBouncer pool mode
+        client_pool_size (int): the connections the application pool opens
+
+    Returns:
+        gcp.cloudrun.ServiceTemplateSpecContainerArgs: the sidecar container
+    """
+    # values set with `pulumi config set --path` are strings
+    max_instances = int(settings.get("max_instances", DEFAULT_MAX_INSTANCES))
+    concurrency = int(
+        settings.get("container_concurrency", DEFAULT_CONTAINER_CONCURRENCY)
+    )
+    connections_per_request = int(settings.get("connections_per_request", 1))
+    pool_size = max(
+        client_pool_size,
+        min(
+            int(settings["db_connections"]) // max_instances,
+            concurrency * connections_per_request,
+        ),
+    )
+    max_client_conn = max(100, concurrency * connections_per_request)
+    envs = dict(
+        DB_HOST=pulumi.Output.concat("/cloudsql/", instance.connection_name),
+        DB_USER=db_name,
+        DB_PASSWORD=pulumi.Config("db").require_secret("db-password"),
+        DB_NAME=db_name,
+        AUTH_TYPE="scram-sha-256",
+        LISTEN_PORT=str(pooler_port),
+        POOL_MODE=pool_mode,
+        DEFAULT_POOL_SIZE=str(pool_size),
+        MAX_DB_CONNECTIONS=str(pool_size),
+        MAX_CLIENT_CONN=str(max_client_conn),
+    )
+    return gcp.cloudrun.ServiceTemplateSpecContainerArgs(
+        name="pgbouncer",
+        image=pooler_image,
+        envs=[
+            gcp.cloudrun.ServiceTemplateSpecContainerEnvArgs(name=name, value=value)
+            for name, value in envs.items()
+        ],
+        resources=dict(limits=dict(memory="256Mi", cpu="1000m")),
+        startup_probe=dict(tcp_socket=dict(port=pooler_port)),
+    )
+
+
+def pooler_annotations(container: str) -> dict:
+    """Revision annotations starting `container` after its PgBouncer sidecar"""
+    return {
+        "run.googleapis.com/container-dependencies": json.dumps(
+            {container: ["pgbouncer"]}
+        )
+    }
@@ -0,0 +1,271 @@
+"""export a trained Keras segmentation model to CPU inference variants for the
+offset tile service, and compare their speed and accuracy on sample tiles
+
+Variants:
+
+- savedmodel: the float32 model traced into a SavedModel graph with a fixed
+  input signature, no Keras needed to serve it
+- frozen: the same graph with its variables folded into constants, written as
+  a single GraphDef
+- xla: the same graph with XLA JIT compilation of the forward pass
+- dynamic: TFLite with int8 weights, float activations
+- float16: TFLite with float16 weights
+- int8: TFLite with int8 weights and activations, calibrated on sample tiles
+
+The tiles are PNG images and labels of the same name, like the tiles of the
+segmentation lessons. Some tiles calibrate the int8 variant, the others are
+used for the report: latency per batch of `--batch-size` tiles and tiles per
+second on `--threads` CPUs, mIoU and its difference from the Keras model, and
+the model size. The fastest variant within `--tolerance` of the Keras mIoU is
+recommended, if any.
+
+The tool needs the packages of requirements-export-model.txt.
+
+Example:
+    python export_model.py --model model_out/ --tiles "tiled/stacks_brightened/*.png" \
+        --labels tiled/labels --out exported --threads 8 --tolerance 0.01
+"""
+import argparse
+import glob
+import json
+import os
+import random
+from typing import Callable, List, Tuple
+
+import numpy as np
+import tensorflow as tf
+from model_metrics import best_variant, mean_iou, time_predictions
+from PIL import Image
+from tensorflow.python.framework.convert_to_constants import (
+    convert_variables_to_constants_v2,
+)
+
+VARIANTS = ["savedmodel", "frozen", "xla", "dynamic", "float16", "int8"]
+
+
+def load_tiles(
+    paths: List[str], label_dir: str, shape: Tuple[int, int], scale: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read image tiles and their labels as model inputs and class ids"""
+    images, labels = [], []
+    for path in paths:
+        image = np.array(Image.open(path).convert("RGB"))
+        label = np.array(Image.open(os.path.join(label_dir, os.path.basename(path))))
+        if label.ndim == 3:
+            label = label[:, :, 0]
+        if image.shape[:2] != shape or label.shape != shape:
+            raise ValueError(f"{path} is not a {shape[0]}x{shape[1]} tile")
+        images.append(image.astype(np.float32) * scale)
+        labels.append(label)
+    return np.stack(images), np.stack(labels)
+
+
+def export_savedmodel(model: tf.keras.Model, path: str, jit_compile: bool = False):
+    """Trace the forward pass into a SavedModel with a fixed input signature"""
+    module = tf.Module()
+    module.model = model
+    module.serve = tf.function(
+        lambda images: model(images, training=False),
+        input_signature=[tf.TensorSpec([None, *model.input_shape[1:]], tf.float32)],
+        jit_compile=jit_compile,
+    )
+    tf.saved_model.save(module, path, signatures={"serving_default": module.serve})
+
+
+def export_frozen(model: tf.keras.Model, path: str):
+    """Freeze the traced forward pass into a GraphDef with its variables as
+    constants, and record its input and output tensor names next to it"""
+    forward = tf.function(lambda images: model(images, training=False))
+    frozen = convert_variables_to_constants_v2(
+        forward.get_concrete_function(
+            tf.TensorSpec([None, *model.input_shape[1:]], tf.float32)
+        )
+    )
+    with open(path, "wb") as f:
+        f.write(frozen.graph.as_graph_def().SerializeToString())
+    with open(path + ".json", "w") as f:
+        json.dump(
+            dict(
+                inputs=[t.name for t in frozen.inputs],
+                outputs=[t.name for t in frozen.outputs],
+            ),
+            f,
+        )
+
+
+def export_tflite(
+    model: tf.keras.Model, path: str, variant: str, calibration: np.ndarray
+):
+    """Convert a Keras model to a quantized TFLite model, with its variables
+    frozen into constants"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+
+        # the inputs and outputs stay float32, so the variants take the same tiles
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+
+
+def load_predictor(
+    variant: str, path: str, threads: int
+) -> Callable[[np.ndarray], np.ndarray]:
+    """A function predicting the class scores of a batch with an exported variant"""
+    if variant in ("savedmodel", "xla"):
+        # keep the loaded object, its variables go away with it
+        loaded = tf.saved_model.load(path)
+        return lambda images: loaded.serve(tf.constant(images)).numpy()
+    if variant == "frozen":
+        graph_def = tf.compat.v1.GraphDef()
+        with open(path, "rb") as f:
+            graph_def.ParseFromString(f.read())
+        with open(path + ".json") as f:
+            names = json.load(f)
+        wrapped = tf.compat.v1.wrap_function(
+            lambda: tf.compat.v1.import_graph_def(graph_def, name=""), []
+        )
+        serve = wrapped.prune(
+            wrapped.graph.get_tensor_by_name(names["inputs"][0]),
+            wrapped.graph.get_tensor_by_name(names["outputs"][0]),
+        )
+        return lambda images: serve(tf.constant(images)).numpy()
+
+    interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+    batch = [0]
+
+    def predict(images: np.ndarray) -> np.ndarray:
+        if len(images) != batch[0]:
+            interpreter.resize_tensor_input(input_index, images.shape)
+            interpreter.allocate_tensors()
+            batch[0] = len(images)
+        interpreter.set_tensor(input_index, images)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+    return predict
+
+
+def model_size(path: str) -> int:
+    """Bytes of a model file or SavedModel directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", required=True, help="saved Keras model")
+    parser.add_argument("--tiles", required=True, help="glob of image tiles")
+    parser.add_argument("--labels", required=True, help="directory of label tiles")
+    parser.add_argument("--out", default="exported", help="output directory")
+    parser.add_argument(
+        "--variants", default=",".join(VARIANTS), help="variants to export"
+    )
+    parser.add_argument("--num-classes", type=int, default=10)
+    parser.add_argument("--scale", type=float, default=1 / 255.0, help="input scale")
+    parser.add_argument(
+        "--calibration", type=int, default=100, help="tiles to calibrate int8 with"
+    )
+    parser.add_argument(
+        "--eval", type=int, default=200, help="tiles to benchmark and evaluate on"
+    )
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="CPUs to run on")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.01, help="accepted mIoU drop"
+    )
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+    model = tf.keras.models.load_model(args.model, compile=False)
+    shape = tuple(model.input_shape[1:3])
+
+    paths = sorted(glob.glob(args.tiles))
+    random.Random(0).shuffle(paths)
+    calibration, _ = load_tiles(
+        paths[: args.calibration], args.labels, shape, args.scale
+    )
+    images, labels = load_tiles(
+        paths[args.calibration : args.calibration + args.eval],
+        args.labels,
+        shape,
+        args.scale,
+    )
+    print(f"{len(calibration)} calibration tiles, {len(images)} evaluation tiles")
+
+    os.makedirs(args.out, exist_ok=True)
+    saved_model_dir = os.path.join(args.out, "savedmodel")
+    export_savedmodel(model, saved_model_dir)
+    keras_miou = mean_iou(
+        lambda batch: model(batch, training=False).numpy(),
+        images,
+        labels,
+        args.num_classes,
+        args.batch_size,
+    )
+
+    results = []
+    for variant in args.variants.split(","):
+        if variant == "savedmodel":
+            path = saved_model_dir
+        elif variant == "frozen":
+            path = os.path.join(args.out, "frozen.pb")
+            export_frozen(model, path)
+        elif variant == "xla":
+            path = os.path.join(args.out, "xla")
+            export_savedmodel(model, path, jit_compile=True)
+        else:
+            path = os.path.join(args.out, f"{variant}.tflite")
+            export_tflite(model, path, variant, calibration)
+        predict = load_predictor(variant, path, args.threads)
+        result = dict(variant=variant, path=path, size_mb=model_size(path) / 1024**2)
+        result.update(time_predictions(predict, images, args.batch_size))
+        result["miou"] = mean_iou(
+            predict, images, labels, args.num_classes, args.batch_size
+        )
+        result["miou_delta"] = result["miou"] - keras_miou
+        results.append(result)
+
+    print(f"\nKeras model mIoU {keras_miou:.4f}, batch size {args.batch_size}")
+    print(
+        f"{'variant':<11} {'batch p50 ms':>12} {'batch p95 ms':>12} "
+        f"{'tiles/s':>8} {'mIoU':>7} {'delta':>8} {'MB':>7}"
+    )
+    for r in results:
+        print(
+            f"{r['variant']:<11} "
+            f"{r['batch_p50_ms']:>12.1f} {r['batch_p95_ms']:>12.1f} "
+            f"{r['tiles_per_second']:>8.1f} {r['miou']:>7.4f} {r['miou_delta']:>+8.4f} "
+            f"{r['size_mb']:>7.1f}"
+        )
+    best = best_variant(results, args.tolerance)
+    if best is None:
+        print(f"\nNo variant within {args.tolerance} mIoU of the Keras model")
+    else:
+        print(
+            f"\nFastest within {args.tolerance} mIoU: {best['variant']} "
+            f"({best['path']})"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(keras_miou=keras_miou, results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
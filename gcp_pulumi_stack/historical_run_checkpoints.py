@@ -0,0 +1,30 @@
+"""bucket of the checkpoints of historical runs
+
+The historical-run function records the chunks of scenes it dispatches in
+this bucket, and the orchestrator records the chunks it has completed (see
+scene_batches.py), so a restarted run only dispatches the chunks that are not
+done.
+"""
+import pulumi
+from pulumi_gcp import compute, storage
+from utils import construct_name
+
+checkpoint_bucket = storage.Bucket(
+    construct_name("bucket-historical-run-checkpoints"),
+    location="EU",
+    labels={"pulumi": "true", "environment": pulumi.get_stack()},
+    lifecycle_rules=[
+        storage.BucketLifecycleRuleArgs(
+            action=storage.BucketLifecycleRuleActionArgs(type="Delete"),
+            condition=storage.BucketLifecycleRuleConditionArgs(age=30),
+        )
+    ],
+)
+
+# the orchestrator runs as the default compute service account
+orchestrator_checkpoint_iam = storage.BucketIAMMember(
+    construct_name("bucket-historical-run-checkpoints-orchestrator-iam"),
+    bucket=checkpoint_bucket.name,
+    role="roles/storage.objectAdmin",
+    member=f"serviceAccount:{compute.get_default_service_account().email}",
+)
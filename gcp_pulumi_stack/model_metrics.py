@@ -0,0 +1,70 @@
+"""accuracy and speed of model variants, used by export_model.py
+
+Only numpy is needed here, the models are called through `predict` functions.
+"""
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from benchmark_stats import percentile
+
+
+def mean_iou(
+    predict: Callable,
+    images: np.ndarray,
+    labels: np.ndarray,
+    num_classes: int,
+    batch_size: int,
+) -> float:
+    """Mean IoU over the classes present in the labels or predictions"""
+    cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+    for start in range(0, len(images), batch_size):
+        preds = np.argmax(predict(images[start : start + batch_size]), axis=-1)
+        truth = labels[start : start + batch_size].astype(np.int64).ravel()
+        preds = preds.astype(np.int64).ravel()
+        valid = truth < num_classes
+        cm += np.bincount(
+            truth[valid] * num_classes + preds[valid], minlength=num_classes**2
+        ).reshape(num_classes, num_classes)
+    tp = np.diag(cm)
+    union = cm.sum(axis=0) + cm.sum(axis=1) - tp
+    return float(np.mean(tp[union > 0] / union[union > 0]))
+
+
+def time_predictions(
+    predict: Callable, images: np.ndarray, batch_size: int, warmup: int = 3
+) -> Dict:
+    """Latency per batch and throughput of a variant, after a few warm up batches
+    that include tracing, XLA compilation and tensor allocation. Only full
+    batches are timed."""
+    batches = [
+        images[start : start + batch_size]
+        for start in range(0, len(images) - batch_size + 1, batch_size)
+    ]
+    if not batches:
+        raise ValueError(
+            f"{len(images)} tiles are fewer than a batch of {batch_size} to time"
+        )
+    for batch in batches[:warmup]:
+        predict(batch)
+    durations = []
+    start = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        predict(batch)
+        durations.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    return dict(
+        batch_p50_ms=1000 * percentile(durations, 50),
+        batch_p95_ms=1000 * percentile(durations, 95),
+        tiles_per_second=len(batches) * batch_size / elapsed,
+    )
+
+
+def best_variant(results: List[Dict], tolerance: float) -> Optional[Dict]:
+    """The fastest variant whose mIoU is within tolerance of the Keras model,
+    None if no variant is"""
+    candidates = [r for r in results if r["miou_delta"] >= -tolerance]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda r: r["tiles_per_second"])
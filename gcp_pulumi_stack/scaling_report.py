@@ -0,0 +1,163 @@
+"""estimate the monthly baseline cost and the cold start latency of the Cloud Run
+autoscaling settings of a stack
+
+For each service, the report lists the setting in the stack config next to the
+alternatives for min_instances, cpu_always_allocated and startup_cpu_boost:
+
+- baseline cost: what the min_instances cost per month while idle
+- cold start: the extra latency of the first request after an idle period,
+  which min_instances > 0 removes and startup_cpu_boost shortens
+
+Services are configured with the `project-cloud:<service>` config objects.
+
+The cold starts are assumptions unless measured: each service has a rough
+default, which its config object can replace with a measured
+`cold_start_seconds`, and the effect of startup CPU boost is a rough guess too,
+which `--startup-boost-factor` can replace. The report marks the values it
+assumed.
+
+Example:
+    python scaling_report.py --stack production
+"""
+import argparse
+import itertools
+import json
+import subprocess
+from typing import Dict
+
+from config_values import flag, parse_cpu, parse_memory
+
+# Limits of each service when the stack does not set them, as declared in
+# cloud_run_orchestrator.py, cloud_run_offset_tile.py and cloud_run_tifeatures.py.
+# The cold starts are unmeasured assumptions: image size and start up work put
+# the orchestrator and offset tile services (model loading) well above tifeatures.
+SERVICES = {
+    "orchestrator": dict(cpu="4000m", memory="4Gi", cold_start_seconds=20),
+    "offset_tile": dict(cpu="8000m", memory="4Gi", cold_start_seconds=30),
+    "tifeatures": dict(cpu="4000m", memory="2Gi", cold_start_seconds=5),
+}
+
+# Cloud Run list prices in USD for Tier 1 regions, per vCPU-second and
+# GiB-second, for idle instances kept by min_instances
+IDLE_RATES = {
+    # CPU only allocated during requests: idle instances are billed at a
+    # reduced rate
+    False: dict(cpu=0.0000025, memory=0.0000025),
+    # CPU always allocated: instances are billed for their whole lifetime
+    True: dict(cpu=0.000018, memory=0.000002),
+}
+SECONDS_PER_MONTH = 730 * 3600
+# share of the cold start left with startup CPU boost, an unmeasured assumption
+STARTUP_BOOST_FACTOR = 0.6
+
+
+def stack_settings(stack: str) -> Dict[str, Dict]:
+    """Read the service settings of a stack with the pulumi CLI"""
+    output = subprocess.run(
+        ["pulumi", "config", "--json", "--stack", stack],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    config = json.loads(output)
+    settings = {}
+    for service in SERVICES:
+        entry = config.get(f"project-cloud:{service}")
+        if entry is None:
+            settings[service] = {}
+        elif "objectValue" in entry:
+            settings[service] = entry["objectValue"]
+        else:
+            settings[service] = json.loads(entry["value"])
+    return settings
+
+
+def estimate(
+    cpu: float,
+    memory: float,
+    cold_start_seconds: float,
+    min_instances: int,
+    cpu_always_allocated: bool,
+    startup_cpu_boost: bool,
+    startup_boost_factor: float = STARTUP_BOOST_FACTOR,
+) -> Dict:
+    """Estimate the monthly baseline cost and cold start of one setting"""
+    rates = IDLE_RATES[cpu_always_allocated]
+    cost = (
+        min_instances
+        * SECONDS_PER_MONTH
+        * (cpu * rates["cpu"] + memory * rates["memory"])
+    )
+    cold_start = 0.0
+    if min_instances == 0:
+        cold_start = cold_start_seconds
+        if startup_cpu_boost:
+            cold_start *= startup_boost_factor
+    return dict(monthly_cost=cost, cold_start=cold_start)
+
+
+def report(
+    settings: Dict[str, Dict], startup_boost_factor: float = STARTUP_BOOST_FACTOR
+):
+    """Print the estimates of the current and alternative settings"""
+    for service, defaults in SERVICES.items():
+        current = {**defaults, **settings.get(service, {})}
+        measured = "cold_start_seconds" in settings.get(service, {})
+        cpu = parse_cpu(current["cpu"])
+        memory = parse_memory(current["memory"])
+        configured = (
+            int(current.get("min_instances", 0)),
+            flag(current.get("cpu_always_allocated", False)),
+            flag(current.get("startup_cpu_boost", False)),
+        )
+        print(f"\n{service} ({cpu:g} vCPU, {memory:g} GiB)")
+        print(
+            f"  cold start {float(current['cold_start_seconds']):g}s, "
+            + ("from the stack config" if measured else "ASSUMED, not measured")
+        )
+        print(
+            f"  {'min':>3} {'cpu always':>10} {'boost':>5} "
+            f"{'USD/month':>10} {'cold start':>10}"
+        )
+        options = itertools.product(
+            sorted({0, 1, configured[0]}), (False, True), (False, True)
+        )
+        for option in options:
+            result = estimate(
+                cpu,
+                memory,
+                float(current["cold_start_seconds"]),
+                *option,
+                startup_boost_factor=startup_boost_factor,
+            )
+            marker = "*" if option == configured else " "
+            print(
+                f"{marker} {option[0]:>3} {str(option[1]):>10} {str(option[2]):>5} "
+                f"{result['monthly_cost']:>10.2f} {result['cold_start']:>9.1f}s"
+            )
+    print("\n* current setting")
+    print(
+        f"Cold starts with startup boost ASSUME it leaves {startup_boost_factor:.0%} "
+        "of the cold start, set --startup-boost-factor from a measurement."
+    )
+    print(
+        "Set cold_start_seconds in a service's config object to replace an "
+        "assumed cold start with a measured one."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stack", required=True, help="the pulumi stack")
+    parser.add_argument(
+        "--startup-boost-factor",
+        type=float,
+        default=STARTUP_BOOST_FACTOR,
+        help="share of the cold start left with startup CPU boost",
+    )
+    args = parser.parse_args()
+    report(stack_settings(args.stack), args.startup_boost_factor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""batched, checkpointed dispatch of the scenes of a historical run
+
+Instead of one orchestrator task per scene, the scenes of a run are grouped in
+chunks of at most `BATCH_SCENES` scenes or `BATCH_TILES` estimated tiles, and
+each chunk is dispatched as one task. A chunk never holds more scenes than fit
+in the task's `DISPATCH_DEADLINE` at `SCENE_SECONDS` per scene.
+
+Chunks are recorded as objects of `CHECKPOINT_BUCKET` under the run's id:
+`{run_id}/dispatched/{chunk_id}.json` once the chunk's task is enqueued, and
+`{run_id}/done/{chunk_id}.json` once the orchestrator has processed all of its
+scenes. The task of a chunk carries the run id and the chunk id, and the
+orchestrator records the chunk with `Checkpoints.complete`. A restarted run
+skips the done chunks, and the chunks dispatched less than `RETRY_WINDOW`
+seconds ago, whose tasks may still be retried; the other chunks are dispatched
+again, so a chunk whose task failed for good is not lost. Chunk ids are a hash
+of their scenes, so they are stable across restarts as long as the scenes are
+listed in the same order.
+
+This module is shipped in the source archive of the historical-run function
+(see cloud_function_historical_run.py), whose handler provides the scenes, the
+tile estimate of a scene and the function enqueueing a chunk.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from google.cloud import storage
+
+
+def settings_from_env() -> Dict:
+    """Read the batching settings the stack gives the historical-run function"""
+    dispatch_deadline = os.getenv("DISPATCH_DEADLINE", "1800s")
+    return dict(
+        batch_scenes=fit_deadline(
+            int(os.getenv("BATCH_SCENES", "1")),
+            dispatch_deadline,
+            int(os.getenv("SCENE_SECONDS", "3540")),
+        ),
+        batch_tiles=int(os.getenv("BATCH_TILES", "0")),
+        dispatch_deadline=dispatch_deadline,
+        retry_window=int(os.getenv("RETRY_WINDOW", "5400")),
+        checkpoint_bucket=os.getenv("CHECKPOINT_BUCKET"),
+    )
+
+
+def fit_deadline(batch_scenes: int, dispatch_deadline: str, scene_seconds: int) -> int:
+    """The number of scenes of a chunk, at most as many as the task deadline
+    gives time for, and at least one
+
+    Args:
+        batch_scenes (int): the configured maximum number of scenes of a chunk
+        dispatch_deadline (str): the deadline of a task, e.g. "1800s"
+        scene_seconds (int): the time the orchestrator may take for a scene
+
+    Returns:
+        int: the maximum number of scenes of a chunk
+    """
+    deadline = int(dispatch_deadline.rstrip("s"))
+    return max(1, min(batch_scenes, deadline // scene_seconds))
+
+
+def chunk_scenes(
+    scenes: Iterable[str],
+    batch_scenes: int = 1,
+    batch_tiles: int = 0,
+    tiles_of: Optional[Callable[[str], int]] = None,
+) -> Iterator[List[str]]:
+    """Group scenes into chunks, in order
+
+    Args:
+        scenes (Iterable[str]): the scene ids
+        batch_scenes (int): the maximum number of scenes of a chunk
+        batch_tiles (int): the maximum number of estimated tiles of a chunk, or
+            0 for no limit. A scene with more tiles is a chunk on its own.
+        tiles_of (Callable[[str], int], optional): the tile estimate of a
+            scene, required with `batch_tiles`
+
+    Yields:
+        List[str]: the scene ids of a chunk
+    """
+    if batch_tiles and tiles_of is None:
+        raise ValueError("batch_tiles needs a tile estimate, tiles_of")
+    chunk: List[str] = []
+    tiles = 0
+    for scene in scenes:
+        scene_tiles = tiles_of(scene) if batch_tiles else 0
+        if chunk and (
+            len(chunk) >= batch_scenes
+            or (batch_tiles and tiles + scene_tiles > batch_tiles)
+        ):
+            yield chunk
+            chunk, tiles = [], 0
+        chunk.append(scene)
+        tiles += scene_tiles
+    if chunk:
+        yield chunk
+
+
+def chunk_id(chunk: List[str]) -> str:
+    """A stable id for a chunk of scenes"""
+    return hashlib.sha1("\n".join(chunk).encode()).hexdigest()
+
+
+class Checkpoints:
+    """The dispatched and done chunks of a run, recorded as objects of a bucket"""
+
+    def __init__(
+        self, bucket: str, run_id: str, client: Optional[storage.Client] = None
+    ):
+        self.bucket = (client or storage.Client()).bucket(bucket)
+        self.prefix = f"{run_id}/"
+
+    def _list(self, state: str) -> Dict[str, float]:
+        prefix = f"{self.prefix}{state}/"
+        return {
+            os.path.splitext(blob.name[len(prefix) :])[0]: blob.updated.timestamp()
+            for blob in self.bucket.list_blobs(prefix=prefix)
+        }
+
+    def _record(self, state: str, chunk_id: str, chunk: List[str]):
+        self.bucket.blob(f"{self.prefix}{state}/{chunk_id}.json").upload_from_string(
+            json.dumps(chunk), content_type="application/json"
+        )
+
+    def done(self) -> Set[str]:
+        """The ids of the chunks the orchestrator has completed"""
+        return set(self._list("done"))
+
+    def dispatched(self) -> Dict[str, float]:
+        """The ids of the dispatched chunks, with the time they were dispatched"""
+        return self._list("dispatched")
+
+    def record(self, chunk_id: str, chunk: List[str]):
+        """Record a dispatched chunk"""
+        self._record("dispatched", chunk_id, chunk)
+
+    def complete(self, chunk_id: str, chunk: List[str]):
+        """Record a chunk whose scenes have all been processed; called by the
+        orchestrator"""
+        self._record("done", chunk_id, chunk)
+
+
+def dispatch(
+    chunks: Iterable[List[str]],
+    enqueue: Callable[[str, List[str]], None],
+    checkpoints: Checkpoints,
+    progress_every: int = 10,
+    retry_window: int = 5400,
+) -> Dict:
+    """Enqueue the chunks not completed or still in flight from a previous run,
+    and record them
+
+    Args:
+        chunks (Iterable[List[str]]): the chunks of the run, from `chunk_scenes`
+        enqueue (Callable[[str, List[str]], None]): creates the task of a chunk,
+            given its id and scenes. The task must carry the chunk id for the
+            orchestrator to complete it.
+        checkpoints (Checkpoints): the run's checkpoints
+        progress_every (int): print the progress every this many chunks
+        retry_window (int): seconds a dispatched chunk may still be retried by
+            the queue, after which a chunk that is not done is dispatched again
+
+    Returns:
+        Dict: the number of chunks and scenes dispatched, and of chunks done or
+        in flight from a previous run
+    """
+    chunks = list(chunks)
+    done = checkpoints.done()
+    dispatched = checkpoints.dispatched()
+    now = time.time()
+    progress = dict(chunks=len(chunks), dispatched=0, skipped=0, in_flight=0, scenes=0)
+    for index, chunk in enumerate(chunks, 1):
+        cid = chunk_id(chunk)
+        if cid in done:
+            progress["skipped"] += 1
+        elif cid in dispatched and now - dispatched[cid] < retry_window:
+            progress["in_flight"] += 1
+        else:
+            enqueue(cid, chunk)
+            # recorded after the task exists, so a failure here only means the
+            # chunk is enqueued again by the next run
+            checkpoints.record(cid, chunk)
+            progress["dispatched"] += 1
+            progress["scenes"] += len(chunk)
+        if index % progress_every == 0 or index == len(chunks):
+            print(
+                "{index}/{chunks} chunks: {dispatched} dispatched "
+                "({scenes} scenes), {skipped} done and {in_flight} in flight "
+                "from a previous run".format(index=index, **progress)
+            )
+    return progress
@@ -0,0 +1,34 @@
+"""make the stack modules importable the way the pulumi program imports them,
+and provide a local fake GCS server"""
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the bucket created in the fake GCS server
+BUCKET = "test-bucket"
+
+
+@pytest.fixture(scope="session")
+def emulator():
+    from gcp_storage_emulator.server import create_server
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    server = create_server("localhost", port, in_memory=True, default_bucket=BUCKET)
+    server.start()
+    yield f"http://localhost:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def client_factory(emulator, monkeypatch):
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", emulator)
+    return lambda: storage.Client(project="test", credentials=AnonymousCredentials())
@@ -0,0 +1,77 @@
+"""tests of the offset tile benchmark statistics and setting selection"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import benchmark_offset_tile as bench
+import pytest
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert bench.percentile(values, 50) == 50
+    assert bench.percentile(values, 95) == 95
+    assert bench.percentile(values, 99) == 99
+    assert bench.percentile(values, 100) == 100
+    assert bench.percentile(values, 0) == 1
+    # nearest rank, whatever the order of the values
+    assert bench.percentile([3.0, 1.0, 2.0], 50) == 2
+    assert bench.percentile([7.0], 95) == 7
+    # q% of n is rounded up, never to the even neighbour
+    assert bench.percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3
+    assert bench.percentile([float(v) for v in range(1, 31)], 95) == 29
+    assert bench.percentile([float(v) for v in range(1, 21)], 95) == 19
+
+
+def result(cpu, concurrency, throughput, p95, errors=0):
+    return dict(
+        cpu=cpu,
+        container_concurrency=concurrency,
+        throughput=throughput,
+        p95=p95,
+        errors=errors,
+    )
+
+
+def test_best_setting():
+    results = [
+        result(2, 1, 1.0, 2.0),
+        result(4, 2, 3.0, 8.0),
+        result(8, 4, 5.0, 30.0),
+        result(8, 6, 9.0, 5.0, errors=1),
+    ]
+    # the fastest setting without errors
+    assert bench.best_setting(results, None) == results[2]
+    # within the p95 budget
+    assert bench.best_setting(results, 10) == results[1]
+    assert bench.best_setting(results, 1) is None
+
+
+def test_best_setting_prefers_fewer_cpus_on_ties():
+    results = [result(8, 3, 4.001, 5.0), result(4, 3, 4.0, 5.0)]
+    assert bench.best_setting(results, None) == results[1]
+
+
+@pytest.fixture
+def server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(500 if self.path == "/fail" else 200)
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+def test_replay_counts_errors(server):
+    requests = [dict(path="/predict", body={})] * 12 + [dict(path="/fail", body={})] * 5
+    stats = bench.replay(server, requests, concurrency=4)
+    assert stats["errors"] == 5
+    assert stats["throughput"] > 0
+    assert 0 < stats["p50"] <= stats["p95"] <= stats["p99"]
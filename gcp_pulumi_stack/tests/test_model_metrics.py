@@ -0,0 +1,55 @@
+"""tests of the accuracy and speed measures of the exported model variants"""
+import model_metrics
+import numpy as np
+import pytest
+
+
+def test_mean_iou():
+    labels = np.array([[[0, 0], [1, 1]], [[1, 2], [2, 9]]])
+    preds = np.array([[[0, 0], [1, 1]], [[2, 2], [2, 0]]])
+    scores = np.eye(3)[preds]
+
+    def predict(images):
+        # the class scores of the tiles, one batch of both
+        return scores[: len(images)]
+
+    # class 1 predicted as 2 once: IoU 2/3 for classes 1 and 2, and the label 9
+    # past the classes is ignored
+    miou = model_metrics.mean_iou(predict, np.zeros(2), labels, 3, 2)
+    assert miou == pytest.approx((1 + 2 / 3 + 2 / 3) / 3)
+    assert model_metrics.mean_iou(lambda images: scores, np.zeros(2), preds, 3, 2) == 1
+
+
+def test_time_predictions_times_full_batches():
+    seen = []
+    result = model_metrics.time_predictions(
+        lambda batch: seen.append(len(batch)), np.zeros((5, 2, 2, 3)), 2, warmup=1
+    )
+    # one warm up batch, then the two full batches; the last tile is left out
+    assert seen == [2, 2, 2]
+    assert result["batch_p50_ms"] <= result["batch_p95_ms"]
+    assert result["tiles_per_second"] > 0
+
+
+def test_time_predictions_needs_a_full_batch():
+    with pytest.raises(ValueError, match="fewer than a batch"):
+        model_metrics.time_predictions(lambda batch: None, np.zeros((3, 2, 2, 3)), 4)
+
+
+def variant(name, tiles_per_second, miou_delta):
+    return dict(variant=name, tiles_per_second=tiles_per_second, miou_delta=miou_delta)
+
+
+def test_best_variant():
+    results = [
+        variant("savedmodel", 10, 0.0),
+        variant("float16", 20, -0.005),
+        variant("int8", 40, -0.05),
+    ]
+    assert model_metrics.best_variant(results, 0.01)["variant"] == "float16"
+    assert model_metrics.best_variant(results, 0.1)["variant"] == "int8"
+
+
+def test_no_variant_within_tolerance():
+    results = [variant("int8", 40, -0.05), variant("dynamic", 30, -0.02)]
+    assert model_metrics.best_variant(results, 0.01) is None
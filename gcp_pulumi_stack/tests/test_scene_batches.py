@@ -0,0 +1,88 @@
+"""tests of the batched dispatch of historical runs"""
+import pytest
+import scene_batches
+
+BUCKET = "test-bucket"
+SCENES = [f"S1A_IW_GRDH_{i:03d}" for i in range(10)]
+
+
+def test_chunk_by_scenes():
+    chunks = list(scene_batches.chunk_scenes(SCENES, batch_scenes=4))
+    assert chunks == [SCENES[:4], SCENES[4:8], SCENES[8:]]
+    assert list(scene_batches.chunk_scenes(SCENES)) == [[scene] for scene in SCENES]
+
+
+def test_chunk_by_tiles():
+    tiles = dict(zip(SCENES, [3, 3, 3, 10, 1, 1, 1, 1, 1, 1]))
+    chunks = list(
+        scene_batches.chunk_scenes(
+            SCENES, batch_scenes=4, batch_tiles=6, tiles_of=tiles.get
+        )
+    )
+    # a scene over the tile budget is a chunk on its own
+    assert chunks == [SCENES[:2], SCENES[2:3], SCENES[3:4], SCENES[4:8], SCENES[8:]]
+    with pytest.raises(ValueError):
+        list(scene_batches.chunk_scenes(SCENES, batch_tiles=6))
+
+
+def test_dispatch_skips_done_and_in_flight_chunks(client_factory):
+    checkpoints = scene_batches.Checkpoints(BUCKET, "run-1", client_factory())
+    chunks = list(scene_batches.chunk_scenes(SCENES, batch_scenes=3))
+    enqueued = []
+
+    def enqueue(chunk_id, chunk):
+        if len(enqueued) == 2:
+            raise ConnectionError("queue unavailable")
+        enqueued.append(chunk_id)
+
+    with pytest.raises(ConnectionError):
+        scene_batches.dispatch(chunks, enqueue, checkpoints)
+    assert set(checkpoints.dispatched()) == set(enqueued)
+    assert checkpoints.done() == set()
+
+    # the orchestrator completes the first chunk; the second is still retried
+    checkpoints.complete(enqueued[0], chunks[0])
+    restarted = []
+    progress = scene_batches.dispatch(
+        chunks, lambda chunk_id, chunk: restarted.append(chunk), checkpoints
+    )
+    assert restarted == chunks[2:]
+    assert progress == dict(chunks=4, dispatched=2, skipped=1, in_flight=1, scenes=4)
+    assert set(checkpoints.dispatched()) == {scene_batches.chunk_id(c) for c in chunks}
+
+    # past the retry window, the chunks that are not done are dispatched again
+    restarted = []
+    progress = scene_batches.dispatch(
+        chunks,
+        lambda chunk_id, chunk: restarted.append(chunk),
+        checkpoints,
+        retry_window=-1,
+    )
+    assert restarted == chunks[1:]
+    assert progress["skipped"] == 1
+
+    # another run has its own checkpoints
+    other = scene_batches.Checkpoints(BUCKET, "run-2", client_factory())
+    assert other.done() == set()
+    assert other.dispatched() == {}
+
+
+def test_fit_deadline():
+    # one scene may take up to the orchestrator timeout, longer than a task
+    assert scene_batches.fit_deadline(20, "1800s", 3540) == 1
+    assert scene_batches.fit_deadline(20, "1800s", 300) == 6
+    assert scene_batches.fit_deadline(4, "1800s", 300) == 4
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("BATCH_SCENES", "20")
+    monkeypatch.setenv("SCENE_SECONDS", "60")
+    monkeypatch.setenv("CHECKPOINT_BUCKET", "checkpoints")
+    monkeypatch.delenv("BATCH_TILES", raising=False)
+    settings = scene_batches.settings_from_env()
+    assert settings["batch_scenes"] == 20
+    # by default a scene may take the whole orchestrator timeout
+    monkeypatch.delenv("SCENE_SECONDS")
+    assert scene_batches.settings_from_env()["batch_scenes"] == 1
+    assert settings["batch_tiles"] == 0
+    assert settings["checkpoint_bucket"] == "checkpoints"
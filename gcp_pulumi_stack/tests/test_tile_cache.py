@@ -0,0 +1,141 @@
+"""tests of the titiler tile cache against a local S3 stand-in"""
+import base64
+import json
+
+import boto3
+import pytest
+import tile_cache
+from moto import mock_aws
+
+BUCKET = "tile-cache"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield tile_cache.TileCache(BUCKET, 3600, "test", client)
+
+
+@pytest.fixture
+def renders():
+    calls = []
+
+    def render(event, context):
+        calls.append(event["rawPath"])
+        if "missing" in event["rawPath"]:
+            return {"statusCode": 404, "body": "not found"}
+        return {
+            "statusCode": 200,
+            "headers": {"content-type": "image/png", "x-request-id": "1"},
+            "body": base64.b64encode(event["rawPath"].encode()).decode(),
+            "isBase64Encoded": True,
+        }
+
+    return render, calls
+
+
+def request(path, method="GET", **params):
+    return {
+        "rawPath": path,
+        "queryStringParameters": params or None,
+        "requestContext": {"http": {"method": method}},
+    }
+
+
+def metrics(capsys):
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    return [record["TileCacheHit"] for record in records]
+
+
+def test_cache_key():
+    key = tile_cache.cache_key(request("/scenes/S1A/tiles/10/1/2.png", b="1", a="2"))
+    assert key.startswith("scenes/S1A/tiles/10/1/2.png/")
+    # the order of the parameters and the api key do not change the tile
+    assert key == tile_cache.cache_key(
+        request("/scenes/S1A/tiles/10/1/2.png", a="2", b="1", api_key="secret")
+    )
+    assert key != tile_cache.cache_key(request("/scenes/S1A/tiles/10/1/2.png", a="3"))
+    assert tile_cache.cache_key(request("/scenes/S1A", method="POST")) is None
+
+
+def test_hit_after_miss(cache, renders, capsys):
+    render, calls = renders
+    handle = tile_cache.cached(render, cache)
+    first = handle(request("/scenes/S1A/tiles/10/1/2.png", rescale="0,1"), None)
+    second = handle(request("/scenes/S1A/tiles/10/1/2.png", rescale="0,1"), None)
+    assert calls == ["/scenes/S1A/tiles/10/1/2.png"]
+    assert base64.b64decode(second["body"]) == base64.b64decode(first["body"])
+    assert second["headers"]["content-type"] == "image/png"
+    assert second["headers"]["x-tile-cache"] == "hit"
+    assert metrics(capsys) == [0, 1]
+
+    # other parameters are another tile
+    handle(request("/scenes/S1A/tiles/10/1/2.png", rescale="0,2"), None)
+    assert len(calls) == 2
+    assert metrics(capsys) == [0]
+
+
+def test_errors_are_not_cached(cache, renders, capsys):
+    render, calls = renders
+    handle = tile_cache.cached(render, cache)
+    for _ in range(2):
+        assert (
+            handle(request("/scenes/missing/tiles/1/1/1.png"), None)["statusCode"]
+            == 404
+        )
+    assert len(calls) == 2
+    assert metrics(capsys) == [0, 0]
+
+
+def test_expired_tiles_are_rendered_again(cache, renders):
+    render, calls = renders
+    cache.ttl = -1
+    handle = tile_cache.cached(render, cache)
+    handle(request("/scenes/S1A/tiles/10/1/2.png"), None)
+    handle(request("/scenes/S1A/tiles/10/1/2.png"), None)
+    assert len(calls) == 2
+
+
+def test_uncacheable_requests_pass_through(cache, renders, capsys):
+    render, calls = renders
+    handle = tile_cache.cached(render, cache)
+    handle(request("/scenes/S1A/tiles/10/1/2.png", method="POST"), None)
+    handle(request("/scenes/S1A/tiles/10/1/2.png", method="POST"), None)
+    assert len(calls) == 2
+    assert metrics(capsys) == []
+
+
+def test_cache_errors_fail_open(cache, renders, capsys):
+    render, calls = renders
+
+    def fail(**kwargs):
+        raise RuntimeError("AccessDenied")
+
+    cache.client.get_object = fail
+    cache.client.put_object = fail
+    handle = tile_cache.cached(render, cache)
+    response = handle(request("/scenes/S1A/tiles/10/1/2.png"), None)
+    assert response["statusCode"] == 200
+    assert calls == ["/scenes/S1A/tiles/10/1/2.png"]
+    out = capsys.readouterr().out
+    assert "read of scenes/S1A/tiles/10/1/2.png" in out
+    assert "write of scenes/S1A/tiles/10/1/2.png" in out
+
+
+def test_hits_need_the_api_key(cache, renders, capsys):
+    render, calls = renders
+    handle = tile_cache.cached(render, cache, api_key="secret")
+    handle(request("/scenes/S1A/tiles/10/1/2.png", api_key="secret"), None)
+    # the tile is cached, but requests without the key are left to the handler
+    handle(request("/scenes/S1A/tiles/10/1/2.png"), None)
+    handle(request("/scenes/S1A/tiles/10/1/2.png", api_key="wrong"), None)
+    assert len(calls) == 3
+    second = handle(request("/scenes/S1A/tiles/10/1/2.png", api_key="secret"), None)
+    assert second["headers"]["x-tile-cache"] == "hit"
+    assert len(calls) == 3
+    assert metrics(capsys) == [0, 1]
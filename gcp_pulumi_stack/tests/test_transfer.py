@@ -0,0 +1,128 @@
+"""tests of the GCS transfer helpers against a local fake GCS server"""
+import gzip
+import os
+
+import pytest
+import transfer
+from google.cloud import storage
+
+BUCKET = "test-bucket"
+CHUNK_SIZE = 16 * 1024
+DATA = os.urandom(10 * CHUNK_SIZE + 123)
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Record the ranges requested, and let tests break chosen chunks"""
+    download = storage.Blob.download_to_file
+    calls = []
+    broken = {}
+
+    def recorded(self, file_obj, **kwargs):
+        calls.append(kwargs["start"])
+        if broken.get(kwargs["start"]) == "fail":
+            raise ConnectionError("connection reset")
+        download(self, file_obj, **kwargs)
+        if broken.get(kwargs["start"]) == "corrupt":
+            file_obj.mm[kwargs["start"]] ^= 0xFF
+
+    monkeypatch.setattr(storage.Blob, "download_to_file", recorded)
+    monkeypatch.setattr(transfer, "MAX_ATTEMPTS", 1)
+    return calls, broken
+
+
+def upload(client_factory, name, data, **properties):
+    blob = client_factory().bucket(BUCKET).blob(name)
+    for key, value in properties.items():
+        setattr(blob, key, value)
+    blob.upload_from_string(data)
+
+
+def download(client_factory, name, out_path, max_workers=4):
+    return transfer.download_blob(
+        BUCKET, name, out_path, client_factory, CHUNK_SIZE, max_workers
+    )
+
+
+def test_download(client_factory, downloads, tmp_path):
+    upload(client_factory, "download", DATA)
+    out_path = str(tmp_path / "download")
+    assert download(client_factory, "download", out_path) == out_path
+    with open(out_path, "rb") as f:
+        assert f.read() == DATA
+    assert os.listdir(tmp_path) == ["download"]
+    assert len(downloads[0]) == 11
+
+
+def test_up_to_date(client_factory, downloads, tmp_path):
+    upload(client_factory, "up_to_date", DATA)
+    out_path = str(tmp_path / "up_to_date")
+    download(client_factory, "up_to_date", out_path)
+    downloads[0].clear()
+    download(client_factory, "up_to_date", out_path)
+    assert downloads[0] == []
+
+
+def test_resume(client_factory, downloads, tmp_path):
+    calls, broken = downloads
+    upload(client_factory, "resume", DATA)
+    out_path = str(tmp_path / "resume")
+    # one thread, so that every chunk before the last one is complete
+    broken[10 * CHUNK_SIZE] = "fail"
+    with pytest.raises(ConnectionError):
+        download(client_factory, "resume", out_path, max_workers=1)
+    assert os.path.exists(out_path + ".part.json")
+
+    calls.clear()
+    broken.clear()
+    download(client_factory, "resume", out_path)
+    assert calls == [10 * CHUNK_SIZE]
+    with open(out_path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_resume_refetches_corrupted_chunks(client_factory, downloads, tmp_path):
+    calls, broken = downloads
+    upload(client_factory, "corrupted", DATA)
+    out_path = str(tmp_path / "corrupted")
+    broken[10 * CHUNK_SIZE] = "fail"
+    with pytest.raises(ConnectionError):
+        download(client_factory, "corrupted", out_path, max_workers=1)
+    # damage a chunk recorded as complete in the manifest
+    with open(out_path + ".part", "r+b") as f:
+        f.seek(CHUNK_SIZE + 10)
+        f.write(b"\0" * 10)
+
+    calls.clear()
+    broken.clear()
+    download(client_factory, "corrupted", out_path)
+    assert sorted(calls) == [CHUNK_SIZE, 10 * CHUNK_SIZE]
+    with open(out_path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_checksum_mismatch(client_factory, downloads, tmp_path):
+    calls, broken = downloads
+    upload(client_factory, "mismatch", DATA)
+    out_path = str(tmp_path / "mismatch")
+    broken[2 * CHUNK_SIZE] = "corrupt"
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        download(client_factory, "mismatch", out_path)
+    assert os.listdir(tmp_path) == []
+
+    # the next run starts over
+    calls.clear()
+    broken.clear()
+    download(client_factory, "mismatch", out_path)
+    assert len(calls) == 11
+    with open(out_path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_gzip_encoded(client_factory, downloads, tmp_path):
+    upload(client_factory, "gzip", gzip.compress(DATA), content_encoding="gzip")
+    out_path = str(tmp_path / "gzip")
+    download(client_factory, "gzip", out_path)
+    with open(out_path, "rb") as f:
+        assert f.read() == DATA
+    assert os.listdir(tmp_path) == ["gzip"]
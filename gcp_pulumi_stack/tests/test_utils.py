@@ -0,0 +1,18 @@
+"""tests of the stack building utils"""
+import utils
+
+
+def test_dispatch_profile_string_overrides():
+    overrides = dict(
+        cpu_per_scene=0.5,
+        connections_per_scene=3,
+        max_instances=20,
+        share=0.25,
+        max_attempts=5,
+        max_dispatches_per_second=2,
+    )
+    as_strings = {key: str(value) for key, value in overrides.items()}
+    assert utils.dispatch_overrides(as_strings) == utils.dispatch_overrides(overrides)
+    assert utils.dispatch_profile(
+        "4000m", "4Gi", 200, utils.dispatch_overrides(as_strings)
+    ) == utils.dispatch_profile("4000m", "4Gi", 200, overrides)
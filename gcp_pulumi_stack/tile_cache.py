@@ -0,0 +1,179 @@
+"""S3 tile cache in front of the titiler lambda handler
+
+`handler` wraps the titiler handler (`TILE_CACHE_HANDLER`, "handler.handler"
+by default). A GET request is keyed on its path, which holds the scene and the
+z/x/y of the tile, and a hash of its sorted query parameters. A cached response
+younger than `TILE_CACHE_TTL` seconds is returned from `TILE_CACHE_BUCKET`
+without rendering; other successful responses are rendered and stored. The
+bucket's lifecycle rule deletes the expired tiles.
+
+The api key is not part of the cache key, so when `API_KEY` is set a request
+only reaches the cache with that key; other requests go straight to the titiler
+handler, which rejects them. The cache fails open: an error reading or writing
+it is logged and the rendered tile is returned.
+
+Every request logs a CloudWatch embedded metric record with its hit or miss in
+the `TILE_CACHE_METRICS_NAMESPACE` namespace.
+
+The module is added to the lambda package by titiler_sentinel.py. boto3 comes
+with the lambda runtime.
+"""
+import base64
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlencode
+
+import boto3
+from botocore.exceptions import ClientError
+
+# query parameters that do not change the tile
+IGNORED_PARAMS = ("api_key",)
+
+
+def cache_key(event: Dict) -> Optional[str]:
+    """The cache key of an API Gateway (HTTP API) request, None if the request
+    is not cacheable"""
+    method = event.get("requestContext", {}).get("http", {}).get("method", "GET")
+    if method != "GET":
+        return None
+    params = sorted(
+        (name, value)
+        for name, value in (event.get("queryStringParameters") or {}).items()
+        if name not in IGNORED_PARAMS
+    )
+    digest = hashlib.sha256(urlencode(params).encode()).hexdigest()[:16]
+    return f"{event['rawPath'].strip('/')}/{digest}"
+
+
+class TileCache:
+    """Cached responses stored as objects of an S3 bucket"""
+
+    def __init__(self, bucket: str, ttl: int, namespace: str, client=None):
+        self.bucket = bucket
+        self.ttl = ttl
+        self.namespace = namespace
+        self.client = client or boto3.client("s3")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """The cached response of a key, None if missing or expired"""
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        if time.time() - obj["LastModified"].timestamp() > self.ttl:
+            return None
+        headers = json.loads(obj["Metadata"].get("headers", "{}"))
+        return {
+            "statusCode": 200,
+            "headers": {**headers, "x-tile-cache": "hit"},
+            "body": base64.b64encode(obj["Body"].read()).decode(),
+            "isBase64Encoded": True,
+        }
+
+    def put(self, key: str, response: Dict):
+        """Store a successful response"""
+        body = response.get("body") or ""
+        if response.get("isBase64Encoded"):
+            body = base64.b64decode(body)
+        else:
+            body = body.encode()
+        headers = {
+            name: value
+            for name, value in (response.get("headers") or {}).items()
+            if name.lower() in ("content-type", "cache-control")
+        }
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType=headers.get("content-type", "application/octet-stream"),
+            Metadata={"headers": json.dumps(headers)},
+        )
+
+    def metric(self, hit: bool):
+        """Log a CloudWatch embedded metric record of a hit or a miss"""
+        print(
+            json.dumps(
+                {
+                    "_aws": {
+                        "Timestamp": int(time.time() * 1000),
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": self.namespace,
+                                "Dimensions": [[]],
+                                "Metrics": [
+                                    {"Name": "TileCacheHit", "Unit": "Count"},
+                                    {"Name": "TileCacheMiss", "Unit": "Count"},
+                                ],
+                            }
+                        ],
+                    },
+                    "TileCacheHit": int(hit),
+                    "TileCacheMiss": int(not hit),
+                }
+            )
+        )
+
+
+def authorized(event: Dict, api_key: Optional[str]) -> bool:
+    """Whether a request carries the api key, always true without one"""
+    if not api_key:
+        return True
+    given = (event.get("queryStringParameters") or {}).get("api_key") or ""
+    return hmac.compare_digest(given.encode(), api_key.encode())
+
+
+def cached(
+    render: Callable, cache: TileCache, api_key: Optional[str] = None
+) -> Callable:
+    """Wrap a lambda handler with a tile cache, used only by requests with the
+    api key"""
+
+    def handle(event: Dict, context) -> Dict:
+        key = cache_key(event) if authorized(event, api_key) else None
+        if key is None:
+            return render(event, context)
+        try:
+            response = cache.get(key)
+        except Exception as e:
+            print(f"tile cache read of {key} failed: {e!r}")
+            response = None
+        cache.metric(response is not None)
+        if response is None:
+            response = render(event, context)
+            if response.get("statusCode") == 200:
+                try:
+                    cache.put(key, response)
+                except Exception as e:
+                    print(f"tile cache write of {key} failed: {e!r}")
+        return response
+
+    return handle
+
+
+_handler = None
+
+
+def handler(event: Dict, context) -> Dict:
+    """The lambda entrypoint, configured from the environment on first use"""
+    global _handler
+    if _handler is None:
+        module, name = os.getenv("TILE_CACHE_HANDLER", "handler.handler").rsplit(".", 1)
+        cache = TileCache(
+            os.environ["TILE_CACHE_BUCKET"],
+            int(os.getenv("TILE_CACHE_TTL", 7 * 24 * 3600)),
+            os.getenv("TILE_CACHE_METRICS_NAMESPACE", "titiler-tile-cache"),
+        )
+        _handler = cached(
+            getattr(importlib.import_module(module), name),
+            cache,
+            os.getenv("API_KEY"),
+        )
+    return _handler(event, context)
@@ -0,0 +1,67 @@
+"""GDAL and rio-tiler performance profiles for the titiler lambda
+
+A stack selects a profile with `project-cloud:titiler_profile`. Lambda
+allocates CPU in proportion to memory (one vCPU per 1769 MB), so profiles
+reading with more threads also ask for more memory. Compare profiles with
+benchmark_titiler.py.
+"""
+from typing import Dict
+
+PROFILES = {
+    # the settings the lambda was deployed with before profiles existed
+    "default": dict(
+        memory_size=3008,
+        env={
+            "GDAL_CACHEMAX": "200",
+            "VSI_CACHE_SIZE": "5000000",
+            "GDAL_INGESTED_BYTES_AT_OPEN": "32768",
+            "RIO_TILER_MAX_THREADS": "1",
+        },
+    ),
+    # read the bands of a tile concurrently on the two vCPUs of 3008 MB
+    "threaded": dict(
+        memory_size=3008,
+        env={
+            "GDAL_CACHEMAX": "200",
+            "VSI_CACHE_SIZE": "5000000",
+            "GDAL_INGESTED_BYTES_AT_OPEN": "32768",
+            "RIO_TILER_MAX_THREADS": "2",
+        },
+    ),
+    # keep more blocks and HTTP ranges between requests to the same scene
+    "large-cache": dict(
+        memory_size=3008,
+        env={
+            "GDAL_CACHEMAX": "512",
+            "VSI_CACHE_SIZE": "50000000",
+            "GDAL_INGESTED_BYTES_AT_OPEN": "65536",
+            "RIO_TILER_MAX_THREADS": "1",
+        },
+    ),
+    # more vCPUs, threads and cache for the busiest stacks
+    "throughput": dict(
+        memory_size=5308,
+        env={
+            "GDAL_CACHEMAX": "1024",
+            "VSI_CACHE_SIZE": "100000000",
+            "GDAL_INGESTED_BYTES_AT_OPEN": "65536",
+            "RIO_TILER_MAX_THREADS": "3",
+        },
+    ),
+}
+
+
+def get_profile(name: str) -> Dict:
+    """Get a performance profile by name
+
+    Args:
+        name (str): a key of PROFILES
+
+    Returns:
+        Dict: the lambda memory_size and the GDAL/rio-tiler environment
+    """
+    if name not in PROFILES:
+        raise ValueError(
+            f"Unknown titiler profile {name!r}, expected one of {sorted(PROFILES)}"
+        )
+    return PROFILES[name]
@@ -1,11 +1,34 @@
 """titiler sentinel infra module"""
+import os
+
 import pulumi
 import pulumi_aws as aws
-from utils import construct_name, create_package, filebase64sha256
+from titiler_profiles import get_profile
+from utils import construct_name, create_package
 
 s3_bucket = aws.s3.Bucket(construct_name("titiler-lambda-archive"))
 
-lambda_package_path = create_package("../")
+# Rendered tiles are cached by scene/z/x/y/params in this bucket by
+# tile_cache.py, which wraps the titiler handler and reads the cache before
+# rendering. S3 deletes tiles once they are older than the TTL, and the
+# handler ignores the ones expired since the last lifecycle run. The lambda
+# can list the bucket, so a missing tile is a 404 rather than a 403.
+tile_cache_ttl_days = pulumi.Config("project-cloud").get_int("tile_cache_ttl_days") or 7
+tile_cache_bucket = aws.s3.Bucket(
+    construct_name("titiler-tile-cache"),
+    lifecycle_rules=[
+        aws.s3.BucketLifecycleRuleArgs(
+            enabled=True,
+            expiration=aws.s3.BucketLifecycleRuleExpirationArgs(
+                days=tile_cache_ttl_days
+            ),
+        )
+    ],
+)
+
+lambda_package_path, lambda_package_hash = create_package(
+    "../", extra_files=[os.path.join(os.path.dirname(__file__), "tile_cache.py")]
+)
 lambda_package_archive = pulumi.FileArchive(lambda_package_path)
 
 lambda_obj = aws.s3.BucketObject(
@@ -33,31 +56,39 @@ iam_for_lambda = aws.iam.Role(
 """,
 )
 
+# GDAL and rio-tiler settings, see titiler_profiles.py
+profile = get_profile(
+    pulumi.Config("project-cloud").get("titiler_profile") or "default"
+)
+
 # Lambda function
 lambda_titiler_sentinel = aws.lambda_.Function(
     resource_name=construct_name("lambda-titiler-sentinel"),
     s3_bucket=s3_bucket.id,
     s3_key=lambda_obj.key,
-    source_code_hash=filebase64sha256(lambda_package_path),
+    source_code_hash=lambda_package_hash,
     runtime="python3.8",
     role=iam_for_lambda.arn,
-    memory_size=3008,
+    memory_size=profile["memory_size"],
     timeout=10,
-    handler="handler.handler",
+    handler="tile_cache.handler",
     environment=aws.lambda_.FunctionEnvironmentArgs(
         variables={
             "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.TIF,.tiff",
-            "GDAL_CACHEMAX": "200",
             "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
-            "GDAL_INGESTED_BYTES_AT_OPEN": "32768",
             "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
             "GDAL_HTTP_MULTIPLEX": "YES",
             "GDAL_HTTP_VERSION": "2",
             "PYTHONWARNINGS": "ignore",
             "VSI_CACHE": "TRUE",
-            "VSI_CACHE_SIZE": "5000000",
             "AWS_REQUEST_PAYER": "requester",
-            "RIO_TILER_MAX_THREADS": 1,
+            **profile["env"],
+            # the titiler handler, wrapped by tile_cache.handler
+            "TILE_CACHE_HANDLER": "handler.handler",
+            "TILE_CACHE_BUCKET": tile_cache_bucket.id,
+            "TILE_CACHE_TTL": str(tile_cache_ttl_days * 24 * 3600),
+            # cache hits and misses are logged as CloudWatch embedded metrics
+            "TILE_CACHE_METRICS_NAMESPACE": construct_name("titiler-tile-cache"),
             "API_KEY": pulumi.Config("project-cloud").require("apikey"),
         },
     ),
@@ -82,6 +113,31 @@ aws.iam.RolePolicyAttachment(
     policy_arn=lambda_s3_policy.arn,
     role=iam_for_lambda.name,
 )
+tile_cache_policy = aws.iam.Policy(
+    construct_name("lambda-titiler-tile-cache-policy"),
+    description="IAM policy for Lambda to read and write cached tiles",
+    policy=tile_cache_bucket.arn.apply(
+        lambda arn: f"""{{
+  "Version": "2012-10-17",
+  "Statement": [
+    {{
+      "Action": ["s3:GetObject", "s3:PutObject"],
+      "Resource": "{arn}/*",
+      "Effect": "Allow"
+    }},
+    {{
+      "Action": "s3:ListBucket",
+      "Resource": "{arn}",
+      "Effect": "Allow"
+    }}
+  ]}}"""
+    ),
+)
+aws.iam.RolePolicyAttachment(
+    construct_name("lambda-titiler-tile-cache-attachment"),
+    policy_arn=tile_cache_policy.arn,
+    role=iam_for_lambda.name,
+)
 aws.iam.RolePolicyAttachment(
     construct_name("lambda-titiler-attachment2"),
     policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
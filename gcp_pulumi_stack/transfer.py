@@ -0,0 +1,260 @@
+"""parallel, resumable downloads of large objects from GCS
+
+Objects are fetched as ranged requests by a pool of threads, written straight
+into a memory-mapped, preallocated `<out_path>.part` file and hashed chunk by
+chunk as they arrive. Completed chunks are recorded in `<out_path>.part.json`,
+so an interrupted download resumes where it stopped. The finished file is
+checked against the object's md5 (or crc32c for composite objects) before it
+replaces `out_path`.
+
+Objects stored with `Content-Encoding: gzip` are served decompressed by GCS
+(decompressive transcoding), which ignores ranges and changes the size. Their
+stored bytes are fetched instead, checked, and decompressed into `out_path`.
+
+The google-cloud-storage client honours `STORAGE_EMULATOR_HOST`, so these
+helpers can be exercised against a local fake GCS server.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import google_crc32c
+from google.cloud import storage
+
+CHUNK_SIZE = 32 * 1024 * 1024
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 5
+
+
+def chunk_digests(
+    filename: str, chunk_size: int = CHUNK_SIZE, max_workers: int = MAX_WORKERS
+) -> List[str]:
+    """Computes the SHA256 hex digest of every chunk of a file in parallel
+
+    Args:
+        filename (str): the file to hash
+        chunk_size (int): the chunk size in bytes
+        max_workers (int): the number of hashing threads
+
+    Returns:
+        List[str]: one digest per chunk, in file order
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    with open(filename, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        view = memoryview(mm)
+        # hashlib releases the GIL on large buffers, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers) as pool:
+            digests = list(
+                pool.map(
+                    lambda start: hashlib.sha256(
+                        view[start : start + chunk_size]
+                    ).hexdigest(),
+                    range(0, size, chunk_size),
+                )
+            )
+        view.release()
+    return digests
+
+
+def _file_checksum(filename: str, algorithm: str) -> str:
+    """Base64-encoded md5 or crc32c of a file, as reported by GCS"""
+    h = hashlib.md5() if algorithm == "md5" else google_crc32c.Checksum()
+    b = bytearray(1024 * 1024)
+    mv = memoryview(b)
+    with open(filename, "rb", buffering=0) as f:
+        for n in iter(lambda: f.readinto(mv), 0):
+            h.update(mv[:n])
+    return base64.b64encode(h.digest()).decode()
+
+
+def _is_transcoded(blob: storage.Blob) -> bool:
+    """Whether GCS serves the object decompressed rather than as stored"""
+    return (blob.content_encoding or "").lower() == "gzip"
+
+
+def matches_blob(blob: storage.Blob, filename: str) -> bool:
+    """Checks whether a local file has the same content as a GCS object, as
+    stored
+
+    Args:
+        blob (storage.Blob): an object fetched with its metadata
+        filename (str): a local file
+
+    Returns:
+        bool: True if the sizes and checksums match
+    """
+    if not os.path.exists(filename) or os.path.getsize(filename) != blob.size:
+        return False
+    # composite objects have no md5, only a crc32c
+    if blob.md5_hash:
+        return _file_checksum(filename, "md5") == blob.md5_hash
+    return _file_checksum(filename, "crc32c") == blob.crc32c
+
+
+class _ChunkWriter:
+    """File-like object writing a downloaded range into a memory map and
+    hashing it as the bytes arrive"""
+
+    def __init__(self, mm: mmap.mmap, offset: int):
+        self.mm = mm
+        self.position = offset
+        self.sha = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.mm[self.position : self.position + len(data)] = data
+        self.position += len(data)
+        self.sha.update(data)
+        return len(data)
+
+
+def _load_manifest(path: str, blob: storage.Blob, chunk_size: int) -> Dict:
+    """Loads the resume manifest of a partial download, or starts a new one if
+    it belongs to another generation of the object or another chunk size"""
+    manifest = dict(
+        generation=blob.generation, size=blob.size, chunk_size=chunk_size, chunks={}
+    )
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        keys = ("generation", "size", "chunk_size")
+        if all(previous.get(key) == manifest[key] for key in keys):
+            return previous
+    return manifest
+
+
+def _save_manifest(path: str, manifest: Dict):
+    """Writes the resume manifest atomically"""
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def download_blob(
+    bucket: str,
+    name: str,
+    out_path: str,
+    client_factory: Callable[[], storage.Client] = storage.Client,
+    chunk_size: int = CHUNK_SIZE,
+    max_workers: int = MAX_WORKERS,
+) -> str:
+    """Downloads a GCS object with parallel ranged requests, resuming a previous
+    partial download and skipping it entirely if `out_path` is up to date
+
+    Args:
+        bucket (str): a bucket name
+        name (str): a object key
+        out_path (str): an output path
+        client_factory (Callable[[], storage.Client]): creates the clients, one
+            for the object's metadata and one per download thread
+        chunk_size (int): the size of each ranged request in bytes
+        max_workers (int): the number of concurrent requests
+
+    Returns:
+        str: out_path
+    """
+    blob = client_factory().bucket(bucket).get_blob(name)
+    if blob is None:
+        raise FileNotFoundError(f"gs://{bucket}/{name} does not exist")
+    # the decompressed copy of a transcoded object cannot be checked against
+    # the checksums of its stored bytes, so it is always fetched again
+    transcoded = _is_transcoded(blob)
+    if not transcoded and matches_blob(blob, out_path):
+        print(f"{out_path} is up to date with gs://{bucket}/{name}")
+        return out_path
+
+    part_path = out_path + ".part"
+    manifest_path = part_path + ".json"
+    manifest = _load_manifest(manifest_path, blob, chunk_size)
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT)
+    try:
+        os.ftruncate(fd, blob.size)
+        if blob.size:
+            if manifest["chunks"]:
+                # keep the chunks from a previous run whose bytes are intact
+                digests = chunk_digests(part_path, chunk_size, max_workers)
+                manifest["chunks"] = {
+                    index: digest
+                    for index, digest in manifest["chunks"].items()
+                    if digests[int(index)] == digest
+                }
+            n_chunks = -(-blob.size // chunk_size)
+            todo = [i for i in range(n_chunks) if str(i) not in manifest["chunks"]]
+            print(
+                f"Downloading gs://{bucket}/{name}: "
+                f"{len(todo)}/{n_chunks} chunks to fetch ..."
+            )
+            with mmap.mmap(fd, blob.size) as mm:
+                lock = threading.Lock()
+                local = threading.local()
+
+                def thread_blob() -> storage.Blob:
+                    # clients are not thread safe, so each thread has its own,
+                    # pinned to the generation read above so that every range
+                    # is read from the same version of the object
+                    if not hasattr(local, "blob"):
+                        local.blob = (
+                            client_factory()
+                            .bucket(bucket)
+                            .blob(name, generation=blob.generation)
+                        )
+                    return local.blob
+
+                def fetch(index: int):
+                    start = index * chunk_size
+                    end = min(start + chunk_size, blob.size) - 1
+                    for attempt in range(MAX_ATTEMPTS):
+                        writer = _ChunkWriter(mm, start)
+                        try:
+                            # the stored bytes, even for transcoded objects
+                            thread_blob().download_to_file(
+                                writer,
+                                start=start,
+                                end=end,
+                                checksum=None,
+                                raw_download=True,
+                            )
+                            if writer.position != end + 1:
+                                raise IOError(f"short read for chunk {index}")
+                            break
+                        except Exception:
+                            if attempt == MAX_ATTEMPTS - 1:
+                                raise
+                            time.sleep(2**attempt)
+                    with lock:
+                        manifest["chunks"][str(index)] = writer.sha.hexdigest()
+                        _save_manifest(manifest_path, manifest)
+
+                with ThreadPoolExecutor(max_workers) as pool:
+                    list(pool.map(fetch, todo))
+                mm.flush()
+    finally:
+        os.close(fd)
+
+    if not matches_blob(blob, part_path):
+        os.remove(part_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        raise ValueError(f"checksum mismatch downloading gs://{bucket}/{name}")
+    if transcoded:
+        with gzip.open(part_path, "rb") as src, open(out_path + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(out_path + ".tmp", out_path)
+        os.remove(part_path)
+    else:
+        os.replace(part_path, out_path)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    return out_path
@@ -1,15 +1,37 @@
 """utils for stack building"""
 import base64
+import fnmatch
+import glob
 import hashlib
+import io
+import json
 import os
+import shlex
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import docker
 import pulumi
-from google.cloud import storage
+import transfer
+from config_values import flag, parse_cpu, parse_memory
 
 project = pulumi.get_project()
 stack = pulumi.get_stack()
 
+# Local cache for build artifacts that are expensive to recreate on every
+# `pulumi up`. Entries older than BUILD_CACHE_MAX_AGE seconds are evicted, and
+# the least recently used entries are evicted beyond BUILD_CACHE_MAX_BYTES.
+BUILD_CACHE_DIR = os.getenv(
+    "BUILD_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", project)
+)
+BUILD_CACHE_MAX_BYTES = int(os.getenv("BUILD_CACHE_MAX_BYTES", 2 * 1024**3))
+BUILD_CACHE_MAX_AGE = int(os.getenv("BUILD_CACHE_MAX_AGE", 30 * 24 * 3600))
+
+TITILER_DOCKERFILE = "Dockerfiles/Dockerfile.titiler"
+
 
 def construct_name(resource_name: str) -> str:
     """construct resource names from project and stack"""
@@ -46,8 +68,269 @@ def filebase64sha256(filename):
     return b.decode()
 
 
+def service_config(service: str) -> dict:
+    """Per-stack settings of a Cloud Run service, from the
+    `project-cloud:<service>` config object"""
+    return pulumi.Config("project-cloud").get_object(service) or {}
+
+
+def scaling_annotations(settings: dict) -> dict:
+    """Revision annotations for the autoscaling settings of a Cloud Run service
+
+    Args:
+        settings (dict): the service settings from `service_config`, with the
+            optional keys min_instances, max_instances, cpu_always_allocated
+            and startup_cpu_boost
+
+    Returns:
+        dict: the knative and Cloud Run annotations for the settings given
+    """
+    annotations = {}
+    if "min_instances" in settings:
+        annotations["autoscaling.knative.dev/minScale"] = str(settings["min_instances"])
+    if "max_instances" in settings:
+        annotations["autoscaling.knative.dev/maxScale"] = str(settings["max_instances"])
+    if "cpu_always_allocated" in settings:
+        annotations["run.googleapis.com/cpu-throttling"] = str(
+            not flag(settings["cpu_always_allocated"])
+        ).lower()
+    if "startup_cpu_boost" in settings:
+        annotations["run.googleapis.com/startup-cpu-boost"] = str(
+            flag(settings["startup_cpu_boost"])
+        ).lower()
+    return annotations
+
+
+# Defaults of a Cloud Tasks dispatch profile, overridable per stack and queue
+DISPATCH_DEFAULTS = dict(
+    # orchestrator resources and database connections held by one scene
+    cpu_per_scene=1.0,
+    memory_per_scene=1.0,
+    connections_per_scene=2,
+    # connections kept for other services, migrations and superusers
+    reserved_connections=50,
+    # Cloud Run's default maximum number of instances
+    max_instances=100,
+    # fraction of the capacity given to the queue
+    share=1.0,
+    # seconds for an idle queue to ramp up to its full concurrency
+    ramp_seconds=10,
+    max_attempts=3,
+    max_backoff="300s",
+    max_doublings=1,
+    max_retry_duration="4s",
+    min_backoff="60s",
+)
+
+
+def dispatch_overrides(settings: dict) -> dict:
+    """Cast dispatch profile overrides read from the stack config to the types
+    of DISPATCH_DEFAULTS, since values set with `pulumi config set --path` are
+    strings. Unknown keys are kept as they are."""
+    types = {key: type(default) for key, default in DISPATCH_DEFAULTS.items()}
+    types.update(max_concurrent_dispatches=int, max_dispatches_per_second=float)
+    return {
+        key: types[key](value) if key in types else value
+        for key, value in settings.items()
+        if value is not None
+    }
+
+
+def dispatch_profile(
+    cpu: str, memory: str, max_connections: int, settings: dict
+) -> dict:
+    """Derive the rate limits and retries of a queue feeding the orchestrator
+
+    Concurrency is the number of scenes the orchestrator instances can process
+    at once given their CPU and memory, capped by the database connections left
+    after `reserved_connections`, and scaled by this queue's `share` of the
+    total. The dispatch rate lets an idle queue reach that concurrency within
+    `ramp_seconds`. Cloud Tasks derives the burst size from the rate.
+
+    Args:
+        cpu (str): the orchestrator CPU limit
+        memory (str): the orchestrator memory limit
+        max_connections (int): the database connection budget
+        settings (dict): overrides of DISPATCH_DEFAULTS, or of the derived
+            max_concurrent_dispatches and max_dispatches_per_second
+
+    Returns:
+        dict: `rate_limits` and `retry_config` arguments for a cloudtasks.Queue
+    """
+    settings = {**DISPATCH_DEFAULTS, **settings}
+    scenes_per_instance = max(
+        1,
+        int(
+            min(
+                parse_cpu(cpu) / settings["cpu_per_scene"],
+                parse_memory(memory) / settings["memory_per_scene"],
+            )
+        ),
+    )
+    scene_slots = scenes_per_instance * settings["max_instances"]
+    db_slots = max_connections - settings["reserved_connections"]
+    db_slots //= settings["connections_per_scene"]
+    capacity = max(1, int(min(scene_slots, db_slots) * settings["share"]))
+    concurrency = settings.get("max_concurrent_dispatches", capacity)
+    rate = settings.get(
+        "max_dispatches_per_second",
+        max(1, -(-concurrency // settings["ramp_seconds"])),
+    )
+    retry_keys = (
+        "max_attempts",
+        "max_backoff",
+        "max_doublings",
+        "max_retry_duration",
+        "min_backoff",
+    )
+    return dict(
+        rate_limits=dict(
+            max_concurrent_dispatches=concurrency, max_dispatches_per_second=rate
+        ),
+        retry_config={key: settings[key] for key in retry_keys},
+    )
+
+
+def _dockerfile_sources(code_dir: str, dockerfile: str) -> List[str]:
+    """List the build context paths consumed by COPY/ADD in a Dockerfile.
+
+    Instructions copying from another build stage (`--from=`) and remote
+    `ADD <url>` sources are skipped, because they are not part of the local
+    context.
+    """
+    with open(os.path.join(code_dir, dockerfile)) as f:
+        # join line continuations so multi-line instructions parse as one
+        instructions = f.read().replace("\\\n", " ").splitlines()
+
+    sources = []
+    for instruction in instructions:
+        parts = instruction.strip().split(None, 1)
+        if len(parts) < 2 or parts[0].upper() not in ("COPY", "ADD"):
+            continue
+        args = parts[1].strip()
+        if args.startswith("["):
+            args = json.loads(args)
+        else:
+            args = shlex.split(args)
+        flags = [arg for arg in args if arg.startswith("--")]
+        if any(flag.startswith("--from") for flag in flags):
+            continue
+        paths = [arg for arg in args if not arg.startswith("--")][:-1]
+        sources.extend(path for path in paths if "://" not in path)
+    return sources
+
+
+def _dockerignore_patterns(code_dir: str) -> List[str]:
+    """Read the patterns of a .dockerignore file, if any, in file order.
+    Patterns starting with "!" re-include files excluded by earlier ones."""
+    path = os.path.join(code_dir, ".dockerignore")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return [line.rstrip("/") for line in lines if line and line[0] != "#"]
+
+
+def _context_files(code_dir: str, sources: List[str]) -> Iterator[str]:
+    """Yield the files of the build context matching `sources`, relative to
+    `code_dir`, skipping ignored files and the package.zip build output."""
+    patterns = _dockerignore_patterns(code_dir) + [
+        "package.zip",
+        ".git",
+        "**/__pycache__",
+        "**/*.pyc",
+    ]
+
+    def is_ignored(path: str) -> bool:
+        parents = [path]
+        while os.path.dirname(parents[-1]):
+            parents.append(os.path.dirname(parents[-1]))
+        # like docker, the last pattern matching a file decides if it is ignored
+        ignored = False
+        for pattern in patterns:
+            negated = pattern.startswith("!")
+            pattern = pattern.lstrip("!").strip()
+            candidates = [pattern]
+            # "**/" also matches at the top level of the context
+            if pattern.startswith("**/"):
+                candidates.append(pattern[3:])
+            if any(
+                fnmatch.fnmatch(parent, candidate)
+                for parent in parents
+                for candidate in candidates
+            ):
+                ignored = not negated
+        return ignored
+
+    for source in sources:
+        for match in glob.glob(os.path.join(code_dir, source)):
+            if os.path.isfile(match):
+                matches = [match]
+            else:
+                matches = (
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(match)
+                    for name in names
+                )
+            for path in matches:
+                relpath = os.path.relpath(path, code_dir)
+                if not is_ignored(relpath):
+                    yield relpath
+
+
+def build_context_hash(code_dir: str, dockerfile: str) -> str:
+    """Hash a Dockerfile together with the part of the build context it copies.
+
+    Args:
+        code_dir (str): the docker build context
+        dockerfile (str): the Dockerfile path, relative to `code_dir`
+
+    Returns:
+        str: a hex digest that changes whenever the build inputs change
+    """
+    h = hashlib.sha256()
+    h.update(dockerfile.encode())
+    with open(os.path.join(code_dir, dockerfile), "rb") as f:
+        h.update(f.read())
+    sources = _dockerfile_sources(code_dir, dockerfile)
+    for relpath in sorted(set(_context_files(code_dir, sources))):
+        h.update(b"\0" + relpath.encode() + b"\0")
+        h.update(sha256sum(os.path.join(code_dir, relpath)))
+    return h.hexdigest()
+
+
+def evict_build_cache(cache_dir: str, keep: Optional[str] = None):
+    """Evict stale and least recently used entries from a build cache directory
+
+    Args:
+        cache_dir (str): directory holding one sub-directory per cache entry
+        keep (str, optional): an entry that must not be evicted
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(".") or not entry.is_dir():
+            continue
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(entry.path)
+            for name in names
+        )
+        entries.append((entry.stat().st_mtime, size, entry))
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    # oldest first, so the least recently used entries are evicted first
+    for last_used, size, entry in sorted(entries, key=lambda e: e[0]):
+        if entry.name == keep:
+            continue
+        if now - last_used > BUILD_CACHE_MAX_AGE or total > BUILD_CACHE_MAX_BYTES:
+            print(f"Evicting cached build {entry.name[:12]} ...")
+            shutil.rmtree(entry.path, ignore_errors=True)
+            total -= size
+
+
 # Build image
-def create_package(code_dir: str) -> str:
+def build_package(code_dir: str, dockerfile: str = TITILER_DOCKERFILE) -> str:
     """Build docker image and create package."""
     print("Creating lambda package [running in Docker]...")
     client = docker.from_env()
@@ -55,7 +338,7 @@ def create_package(code_dir: str) -> str:
     print("Building docker image...")
     client.images.build(
         path=code_dir,
-        dockerfile="Dockerfiles/Dockerfile.titiler",
+        dockerfile=dockerfile,
         tag="titiler-lambda:latest",
         rm=True,
     )
@@ -69,7 +352,126 @@ def create_package(code_dir: str) -> str:
         user=0,
     )
     print("Copied package package.zip ...")
-    return f"{code_dir}package.zip"
+    return os.path.join(code_dir, "package.zip")
+
+
+def create_package(
+    code_dir: str,
+    dockerfile: str = TITILER_DOCKERFILE,
+    extra_files: Sequence[str] = (),
+) -> Tuple[str, str]:
+    """Create the lambda package, reusing a cached build when neither the
+    Dockerfile nor the sources it copies changed since the last build.
+
+    Args:
+        code_dir (str): the docker build context
+        dockerfile (str): the Dockerfile path, relative to `code_dir`
+        extra_files (Sequence[str]): files added at the root of the package
+            after the build, such as modules of this stack run by the lambda
+
+    Returns:
+        Tuple[str, str]: the package.zip path and its filebase64sha256 digest
+    """
+    cache_dir = os.path.join(BUILD_CACHE_DIR, "lambda-packages")
+    os.makedirs(cache_dir, exist_ok=True)
+    h = hashlib.sha256(build_context_hash(code_dir, dockerfile).encode())
+    for path in sorted(extra_files):
+        h.update(b"\0" + os.path.basename(path).encode() + b"\0")
+        h.update(sha256sum(path))
+    key = h.hexdigest()
+    entry = os.path.join(cache_dir, key)
+    package = os.path.join(entry, "package.zip")
+    digest_file = os.path.join(entry, "package.zip.sha256")
+
+    if os.path.exists(digest_file):
+        print(f"Reusing cached lambda package {key[:12]} ...")
+        # mark the entry as recently used for eviction
+        os.utime(entry)
+        with open(digest_file) as f:
+            return package, f.read().strip()
+
+    built = build_package(code_dir, dockerfile)
+    # stage the entry next to its final location so it appears atomically
+    staging = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    staged = os.path.join(staging, "package.zip")
+    shutil.copyfile(built, staged)
+    if extra_files:
+        with zipfile.ZipFile(staged, "a", zipfile.ZIP_DEFLATED) as archive:
+            for path in sorted(extra_files):
+                archive.write(path, os.path.basename(path))
+    digest = filebase64sha256(staged)
+    with open(os.path.join(staging, "package.zip.sha256"), "w") as f:
+        f.write(digest)
+    try:
+        os.rename(staging, entry)
+    except OSError:
+        # a concurrent build stored the same key first
+        shutil.rmtree(staging, ignore_errors=True)
+    print(f"Cached lambda package {key[:12]} ...")
+
+    evict_build_cache(cache_dir, keep=key)
+    return package, digest
+
+
+def _archive_files(source_dir: str) -> Iterator[str]:
+    """Yield the files of a source directory in a stable order, relative to
+    `source_dir`, skipping bytecode caches"""
+    for root, dirs, names in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(names):
+            if name.endswith(".pyc") or name == ".DS_Store":
+                continue
+            yield os.path.relpath(os.path.join(root, name), source_dir)
+
+
+def create_source_archive(
+    source_dir: str, extra_files: Sequence[str] = ()
+) -> Tuple[str, str]:
+    """Zip a source directory into a byte-reproducible archive named by its hash
+
+    Entries are added recursively in sorted order with fixed timestamps and
+    permissions, so unchanged sources always produce the same archive, and
+    therefore the same object name and no redeploy.
+
+    Args:
+        source_dir (str): the directory to archive
+        extra_files (Sequence[str]): files added at the root of the archive,
+            such as modules of this stack shared with the function
+
+    Returns:
+        Tuple[str, str]: the local archive path and its content-addressed name
+    """
+    entries = [
+        (relpath, os.path.join(source_dir, relpath))
+        for relpath in _archive_files(source_dir)
+    ]
+    entries += [(os.path.basename(path), path) for path in sorted(extra_files)]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for relpath, path in entries:
+            info = zipfile.ZipInfo(relpath.replace(os.sep, "/"), (1980, 1, 1, 0, 0, 0))
+            info.create_system = 3
+            mode = 0o755 if os.access(path, os.X_OK) else 0o644
+            info.external_attr = (0o100000 | mode) << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, "rb") as f:
+                archive.writestr(info, f.read())
+    data = buffer.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+
+    cache_dir = os.path.join(BUILD_CACHE_DIR, "source-archives")
+    entry = os.path.join(cache_dir, digest)
+    name = f"{os.path.basename(os.path.normpath(source_dir))}-{digest}.zip"
+    path = os.path.join(entry, name)
+    if not os.path.exists(path):
+        os.makedirs(entry, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=entry, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+    # mark the entry as recently used for eviction
+    os.utime(entry)
+    evict_build_cache(cache_dir, keep=digest)
+    return path, name
 
 
 def get_file_from_gcs(bucket: str, name: str, out_path: str) -> pulumi.FileAsset:
@@ -83,10 +485,7 @@ def get_file_from_gcs(bucket: str, name: str, out_path: str) -> pulumi.FileAsset
     Returns:
         pulumi.FileAsset: The output file asset from local file downloaded from GCS
     """
-    storage_client = storage.Client()
-    gcp_bucket = storage_client.get_bucket(bucket)
-    # Create a blob object from the filepath
-    blob = gcp_bucket.blob(name)
-    # Download the file to a destination
-    blob.download_to_filename(out_path)
+    # Download the file to a destination, in parallel chunks, resuming a
+    # partial download and skipping it if the local file is up to date
+    transfer.download_blob(bucket, name, out_path)
     return pulumi.FileAsset(out_path)